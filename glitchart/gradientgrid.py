@@ -2,6 +2,10 @@ import pygame
 import random
 import os
 import sys
+import argparse
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
 # Configuration
@@ -12,10 +16,23 @@ random_shape_freq = True
 shape_freq = 75
 i_shape_freq = shape_freq
 image_scale = 1
+headless = False  # Render to an offscreen surface, without a display or window
+seed = None  # Seed for shape sizes and gradient noise; None gives a new image every run
+occlusion_culling = True  # Skip gradients and shadows that later gradients cover completely
+workers = 1  # Processes drawing bands of the canvas; the output is the same for any count
 
-# Initialize pygame
-pygame.init()
-print("Initialized pygame")
+# Largest ring index an 8-bit radial gradient stamp can hold
+MAX_STAMP_RADIUS = 255
+
+# Canvas bands per worker process, so uneven bands still keep every core busy
+BANDS_PER_WORKER = 4
+
+# splitmix64 constants
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX1, MIX2 = np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB)
+
+# Top-left canvas pixel of the surface being drawn on, which may be one band of the canvas
+origin = (0, 0)
 
 def clamp(value, min_val=0, max_val=255):
     return max(min_val, min(value, max_val))
@@ -28,92 +45,214 @@ def to_color(color, alpha=255):
     return pygame.Color(clamp(color[0]), clamp(color[1]), clamp(color[2]), clamp(color[3]))
 
 def brightness(color):
-    color = to_color(color)
-    return 0.299 * color.r + 0.587 * color.g + 0.114 * color.b
+    """Luma of an RGB color, or of every color along the last axis of an array"""
+    color = np.asarray(color)
+    return 0.299 * color[..., 0] + 0.587 * color[..., 1] + 0.114 * color[..., 2]
+
+def splitmix64(z):
+    """splitmix64 output for each state in a uint64 array (wrapping arithmetic)"""
+    z = z + GOLDEN_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * MIX1
+    z = (z ^ (z >> np.uint64(27))) * MIX2
+    return z ^ (z >> np.uint64(31))
+
+def gradient_noise(index, count):
+    """count uniform draws in [0, 1) from the own noise stream of gradient index.
+    
+    Draw k is a hash of (render_seed, index, k), so any process can produce a
+    gradient's noise without replaying the draws of the gradients before it.
+    """
+    key = splitmix64(splitmix64(np.array([render_seed], dtype=np.uint64)) ^ np.uint64(index))
+    draws = splitmix64(key + np.arange(count, dtype=np.uint64) * GOLDEN_GAMMA)
+    return (draws >> np.uint64(11)) * 2.0 ** -53
+
+def sample_colors(source, xs, ys):
+    """RGB colors of a (width, height, 3) source array at each (x, y), black outside it"""
+    inside = (xs >= 0) & (xs < source.shape[0]) & (ys >= 0) & (ys < source.shape[1])
+    colors = np.zeros((len(xs), 3), dtype=int)
+    colors[inside] = source[xs[inside], ys[inside]]
+    return colors
 
 class Gradient:
-    def __init__(self, x, y, w, h):
+    def __init__(self, x, y, w, h, index=0):
         self.x = x
         self.y = y
         self.w = w
         self.h = h
         self.size = w * h  # Track shape size for shadow selection
+        self.index = index  # Position in the grid, which picks the noise stream
     
-    def get_color1(self, x, y):
-        if 0 <= x < screen_width and 0 <= y < screen_height:
-            return to_color(img.get_at((x, y)))
-        return pygame.Color(0, 0, 0)
-    
-    def get_color2(self, x, y):
-        if 0 <= x < screen_width and 0 <= y < screen_height:
-            return to_color(img.get_at((x, y)))
-        return pygame.Color(0, 0, 0)
+    def footprint(self, shadow=False):
+        """Screen window (left, top, right, bottom) and mask of the pixels the gradient or its shadow draws"""
+        if gradient_type == 0:
+            if shadow:
+                left, top = self.x + 1, self.y + self.h + 1
+                mask = np.ones((self.w + 1, 1), dtype=bool)
+            else:
+                left, top = self.x, self.y
+                mask = np.ones((self.w, self.h + 1), dtype=bool)
+        else:
+            # A shadow circle covers no more than all the rings of the same radius
+            offset = 1 if shadow else 0
+            left, top = self.x + offset - self.w - 1, self.y + offset - self.w - 1
+            mask = ring_coverage(self.w)
+        
+        right, bottom = min(left + mask.shape[0], screen_width), min(top + mask.shape[1], screen_height)
+        clip_left, clip_top = max(left, 0), max(top, 0)
+        return (clip_left, clip_top, right, bottom), mask[clip_left - left:right - left, clip_top - top:bottom - top]
     
     def draw_shadow(self, color):
         """Draw 1px dropshadow with 20% opacity"""
         shadow_color = to_color(color, 51)  # 20% of 255
+        x, y = self.x - origin[0], self.y - origin[1]
         if gradient_type == 0:  # Linear gradient shadow
             pygame.draw.line(screen, shadow_color, 
-                           (self.x+1, self.y+self.h+1), 
-                           (self.x+self.w+1, self.y+self.h+1), 1)
+                           (x+1, y+self.h+1), 
+                           (x+self.w+1, y+self.h+1), 1)
         else:  # Radial gradient shadow
             pygame.draw.circle(screen, shadow_color, 
-                             (self.x+1, self.y+1), self.w)
+                             (x+1, y+1), self.w)
     
     def draw_linear_gradient(self, c1, c2):
-        c1 = to_color(c1)
-        c2 = to_color(c2)
-        for i in range(self.x, min(self.x + self.w, screen_width)):
-            inter = (i - self.x) / self.w
-            r = random.uniform(0, 8)
-            new_r = clamp(int(c1.r + (c2.r - c1.r) * inter * r))
-            new_g = clamp(int(c1.g + (c2.g - c1.g) * inter * r))
-            new_b = clamp(int(c1.b + (c2.b - c1.b) * inter * r))
-            color = pygame.Color(new_r, new_g, new_b)
-            pygame.draw.line(screen, color, (i, self.y), (i, min(self.y + self.h, screen_height)))
+        """Fill the whole block of columns at once, each scaled by its own random factor"""
+        c1 = np.array(to_color(c1)[:3])
+        c2 = np.array(to_color(c2)[:3])
+        x_end = min(self.x + self.w, screen_width)
+        if x_end <= self.x:
+            return
+        inter = (np.arange(self.x, x_end) - self.x) / self.w
+        r = 8 * gradient_noise(self.index, x_end - self.x)
+        colors = np.clip((c1 + (c2 - c1) * (inter * r)[:, None]).astype(int), 0, 255)
+        
+        # Columns span y to y + h inclusive, like the vertical lines they replace
+        y_end = min(self.y + self.h + 1, screen_height)
+        width, height = screen.get_size()
+        left, top = max(self.x - origin[0], 0), max(self.y - origin[1], 0)
+        right, bottom = min(x_end - origin[0], width), min(y_end - origin[1], height)
+        if right <= left or bottom <= top:
+            return
+        pixels = pygame.surfarray.pixels3d(screen)
+        start = left - (self.x - origin[0])
+        pixels[left:right, top:bottom] = colors[start:start + right - left, None]
+        del pixels  # Unlocks the surface
     
     def draw_radial_gradient(self, c1, c2):
-        c1 = to_color(c1)
-        c2 = to_color(c2)
-        for i in range(self.w, 0, -1):
-            inter = i / self.w
-            r = random.uniform(0.1, 2)
-            new_r = clamp(int(c1.r + (c2.r - c1.r) * inter * r))
-            new_g = clamp(int(c1.g + (c2.g - c1.g) * inter * r))
-            new_b = clamp(int(c1.b + (c2.b - c1.b) * inter * r))
-            color = pygame.Color(new_r, new_g, new_b)
-            pygame.draw.circle(screen, color, (self.x, self.y), i)
+        """Blit the cached ring stamp once, with each ring's color looked up through its palette"""
+        c1 = np.array(to_color(c1)[:3])
+        c2 = np.array(to_color(c2)[:3])
+        # Ring i gets its own random factor; the draws run from the outer ring in
+        radii = np.arange(self.w, 0, -1)
+        r = 0.1 + 1.9 * gradient_noise(self.index, self.w)
+        lut = np.zeros((self.w + 1, 3), dtype=int)
+        lut[radii] = np.clip((c1 + (c2 - c1) * (radii / self.w * r)[:, None]).astype(int), 0, 255)
+        
+        # Palette indices stop at 255, so rings beyond that are drawn as circles
+        x, y = self.x - origin[0], self.y - origin[1]
+        for i in range(self.w, MAX_STAMP_RADIUS, -1):
+            pygame.draw.circle(screen, lut[i].tolist(), (x, y), i)
+        radius = min(self.w, MAX_STAMP_RADIUS)
+        stamp = ring_stamp(radius)
+        stamp.set_palette(lut[:radius + 1].tolist())
+        screen.blit(stamp, (x - radius - 1, y - radius - 1))
 
-def main():
-    global screen, screen_width, screen_height, img, shape_freq
+@functools.lru_cache(maxsize=64)
+def ring_coverage(radius):
+    """Mask of every pixel the rings of a radial gradient cover, laid out like ring_stamp"""
+    reach = radius + 1
+    surface = pygame.Surface((2 * reach + 1, 2 * reach + 1), 0, 8)
+    for i in range(radius, 0, -1):
+        pygame.draw.circle(surface, 1, (reach, reach), i)
+    return pygame.surfarray.array2d(surface) > 0
+
+def find_visible(gradients, shadows):
+    """Masks of the gradients and shadows that stay at least partly visible.
     
-    print(f"Loading image: {image_name}.png")
-    try:
-        pil_img = Image.open(image_name + ".png")
-        img_width, img_height = pil_img.size
-        screen_width, screen_height = img_width * image_scale, img_height * image_scale
-        print(f"Screen size: {screen_width}x{screen_height}")
-        screen = pygame.display.set_mode((screen_width, screen_height))
-        
-        img = pygame.image.fromstring(pil_img.tobytes(), pil_img.size, pil_img.mode)
-        img = pygame.transform.scale(img, (screen_width, screen_height))
-    except Exception as e:
-        print(f"Error loading image: {str(e)}")
-        sys.exit(1)
+    Walks the gradients in reverse draw order over a coverage grid of the
+    pixels already claimed by later gradients: a gradient whose footprint is
+    fully claimed is hidden. Shadows are drawn before every gradient, so they
+    are tested against the finished grid.
+    """
+    coverage = np.zeros((screen_width, screen_height), dtype=bool)
+    visible = np.zeros(len(gradients), dtype=bool)
+    for index in range(len(gradients) - 1, -1, -1):
+        (left, top, right, bottom), mask = gradients[index].footprint()
+        if right <= left or bottom <= top:
+            continue
+        window = coverage[left:right, top:bottom]
+        visible[index] = not (window | ~mask).all()
+        window |= mask
+    
+    shadows_visible = np.zeros(len(shadows), dtype=bool)
+    for index, shape in enumerate(shadows):
+        (left, top, right, bottom), mask = shape.footprint(shadow=True)
+        if right > left and bottom > top:
+            shadows_visible[index] = not (coverage[left:right, top:bottom] | ~mask).all()
+    return visible, shadows_visible
 
-    os.makedirs("done", exist_ok=True)
-    screen.fill(to_color(img.get_at((1, 1))))
-    pygame.display.flip()
+@functools.lru_cache(maxsize=64)
+def ring_stamp(radius):
+    """8-bit surface holding the innermost ring covering each pixel, centered on (radius + 1, radius + 1).
+    
+    The rings are drawn with pygame.draw.circle itself, largest first, so the
+    stamp covers exactly the pixels the nested circles of a radial gradient
+    would. Index 0 lies outside every ring and is transparent.
+    """
+    reach = radius + 1
+    stamp = pygame.Surface((2 * reach + 1, 2 * reach + 1), 0, 8)
+    for i in range(radius, 0, -1):
+        # A raw pixel value, so each ring holds its own palette index
+        pygame.draw.circle(stamp, i, (reach, reach), i)
+    stamp.set_colorkey(0)
+    return stamp
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="Render offscreen without opening a window")
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible image")
+    parser.add_argument("--workers", type=int, help="Processes drawing bands of the canvas")
+    return parser.parse_args()
+
+def create_screen(size):
+    """Offscreen surface when headless, otherwise a display window"""
+    if headless:
+        # Same 32-bit format as a display surface; needs no SDL video init
+        return pygame.Surface(size, 0, 32)
+    pygame.display.init()
+    print("Initialized pygame display")
+    return pygame.display.set_mode(size)
+
+def render(pil_img):
+    """Draw the gradient grid for a PIL image and return the pygame surface holding it"""
+    global screen, screen_width, screen_height, render_seed, origin
+    
+    # A fixed seed fixes the whole image, however many workers draw it
+    render_seed = seed if seed is not None else random.SystemRandom().getrandbits(64)
+    print(f"Seed: {render_seed}")
+    
+    img_width, img_height = pil_img.size
+    screen_width, screen_height = img_width * image_scale, img_height * image_scale
+    print(f"Screen size: {screen_width}x{screen_height}")
+    canvas = create_screen((screen_width, screen_height))
+    
+    img = pygame.image.fromstring(pil_img.tobytes(), pil_img.size, pil_img.mode)
+    img = pygame.transform.scale(img, (screen_width, screen_height))
+    
+    background = to_color(img.get_at((1, 1)))
+    canvas.fill(background)
+    if not headless:
+        pygame.display.flip()
 
     # Generate all gradients first to determine largest shapes
+    layout = random.Random(render_seed)
+    freq = shape_freq
     gradients = []
-    for x in range(0, screen_width + 1, max(1, screen_width // shape_freq)):
-        for y in range(0, screen_height + 1, max(1, screen_height // shape_freq)):
-            w = max(1, screen_width // shape_freq * 2)
-            h = max(1, screen_height // shape_freq * 2)
-            gradients.append(Gradient(x, y, w, h))
+    for x in range(0, screen_width + 1, max(1, screen_width // freq)):
+        for y in range(0, screen_height + 1, max(1, screen_height // freq)):
+            w = max(1, screen_width // freq * 2)
+            h = max(1, screen_height // freq * 2)
+            gradients.append(Gradient(x, y, w, h, len(gradients)))
             if random_shape_freq:
-                shape_freq = int(random.uniform(25, i_shape_freq))
+                freq = int(layout.uniform(25, i_shape_freq))
 
     # Find largest 10% of shapes for shadows
     gradients.sort(key=lambda g: g.size, reverse=True)
@@ -121,30 +260,99 @@ def main():
 
     print(f"Drawing {len(gradients)} gradients with shadows on {len(large_shapes)} largest")
     
-    # Draw shadows first
-    for shape in large_shapes:
-        c1 = shape.get_color1(shape.x, shape.y)
-        shape.draw_shadow(c1)
+    # Sample every endpoint color at once
+    source = pygame.surfarray.array3d(img)
+    xs, ys, ws, hs = np.array([(shape.x, shape.y, shape.w, shape.h) for shape in gradients]).T
+    c1 = sample_colors(source, xs, ys)
+    c2 = sample_colors(source, xs + ws, ys + hs)
+    # Edge smoothing starts from a point up and to the left instead
+    c3 = sample_colors(source, xs - ws // (10 if gradient_type == 0 else 20), ys - hs)
+    smooth = edge_smoothing & (brightness(c1) - brightness(c2) > 10)
+    starts = np.where(smooth[:, None], c3, c1).tolist()
+    ends = np.where(smooth[:, None], c1, c2).tolist()
+    
+    if occlusion_culling:
+        visible, shadows_visible = find_visible(gradients, large_shapes)
+        print(f"Culled {len(gradients) - visible.sum()} hidden gradients")
+    else:
+        visible, shadows_visible = np.ones(len(gradients), dtype=bool), np.ones(len(large_shapes), dtype=bool)
+    
+    # Shadows first, then all gradients, each with the rows of the canvas it touches
+    shadows = [(shape, c1[index].tolist(), shape.footprint(shadow=True)[0])
+               for index, shape in enumerate(large_shapes) if shadows_visible[index]]
+    shapes = [(shape, starts[index], ends[index], shape.footprint()[0])
+              for index, shape in enumerate(gradients) if visible[index]]
+    
+    band_count = min(screen_height, workers * BANDS_PER_WORKER) if workers > 1 else 1
+    edges = np.linspace(0, screen_height, band_count + 1).astype(int)
+    settings = ((screen_width, screen_height), gradient_type, render_seed)
+    jobs = []
+    for top, bottom in zip(edges[:-1].tolist(), edges[1:].tolist()):
+        band_shadows = [(shape, color) for shape, color, box in shadows if box[1] < bottom and box[3] > top]
+        band_shapes = [(shape, start, end) for shape, start, end, box in shapes if box[1] < bottom and box[3] > top]
+        jobs.append((settings, (0, top, screen_width, bottom), background, band_shadows, band_shapes))
+    
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            bands = list(pool.map(render_band, *zip(*jobs)))
+    else:
+        bands = [render_band(*job) for job in jobs]
+    
+    pixels = pygame.surfarray.pixels3d(canvas)
+    for (_, (left, top, right, bottom), _, _, _), band in zip(jobs, bands):
+        pixels[left:right, top:bottom] = band
+    del pixels  # Unlocks the surface
+    
+    screen, origin = canvas, (0, 0)
+    if not headless:
+        pygame.display.flip()
+    return screen
 
-    # Then draw all gradients
-    for shape in gradients:
-        c1 = shape.get_color1(shape.x, shape.y)
-        c2 = shape.get_color2(shape.x + shape.w, shape.y + shape.h)
-        
+def render_band(settings, box, background, shadows, shapes):
+    """Draw shadows and gradients onto one box of the canvas and return its (width, height, 3) pixels.
+    
+    settings carries the canvas size, gradient type and seed, so a worker
+    process draws exactly what the parent would.
+    """
+    global screen, screen_width, screen_height, gradient_type, render_seed, origin
+    
+    (screen_width, screen_height), gradient_type, render_seed = settings
+    left, top, right, bottom = box
+    origin = (left, top)
+    screen = pygame.Surface((right - left, bottom - top), 0, 32)
+    screen.fill(background)
+    
+    for shape, color in shadows:
+        shape.draw_shadow(color)
+    for shape, start, end in shapes:
         if gradient_type == 0:
-            if edge_smoothing and brightness(c1) - brightness(c2) > 10:
-                shape.draw_linear_gradient(shape.get_color2(shape.x - shape.w//10, shape.y - shape.h), c1)
-            else:
-                shape.draw_linear_gradient(c1, c2)
+            shape.draw_linear_gradient(start, end)
         else:
-            if edge_smoothing and brightness(c1) - brightness(c2) > 10:
-                shape.draw_radial_gradient(shape.get_color2(shape.x - shape.w//20, shape.y - shape.h), c1)
-            else:
-                shape.draw_radial_gradient(c1, c2)
+            shape.draw_radial_gradient(start, end)
+    return pygame.surfarray.array3d(screen)
+
+def main():
+    global headless, seed, workers
+    
+    args = parse_args()
+    if args.headless:
+        headless = True
+    if args.seed is not None:
+        seed = args.seed
+    if args.workers:
+        workers = args.workers
+    
+    print(f"Loading image: {image_name}.png")
+    try:
+        pil_img = Image.open(image_name + ".png")
+    except Exception as e:
+        print(f"Error loading image: {str(e)}")
+        sys.exit(1)
+    surface = render(pil_img)
 
-    pygame.display.flip()
+    os.makedirs("done", exist_ok=True)
     output_path = f"done/{image_name}_with_shadow.png"
-    pygame.image.save(screen, output_path)
+    pygame.image.save(surface, output_path)
     print(f"Saved to {output_path}")
     pygame.quit()
 
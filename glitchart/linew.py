@@ -1,9 +1,14 @@
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor, ImageDraw, ImageSequence
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import random
 import math
 import numpy as np
 import os
 import argparse
+import functools
+
+from streaming import write_gif, write_png
 
 def hex_to_rgb(hex_color):
     """Convert hex color code to RGB tuple"""
@@ -20,57 +25,365 @@ DEFAULT_SETTINGS = {
     'BACKGROUND_COLOR': "#000000",  # Black by default
     'SAVE_FRAMES': True,
     'FRAMES': 1,
-    'SHAPE_TYPE': 0,
+    'SHAPE_TYPE': 0,  # SHAPE_RECT, SHAPE_ELLIPSE, SHAPE_CROSS or SHAPE_DOT
     'ANIMATED_INPUT': False,
-    'INPUT_FRAMES': 0
+    'INPUT_FRAMES': 0,
+    'TILE_SIZE': 0,  # Render stills in square tiles of this size; 0 draws the whole canvas at once
+    'OUTPUT_FORMAT': 'png'  # 'svg' writes stills as resolution-independent vector paths
 }
 
+# Shape types
+SHAPE_RECT, SHAPE_ELLIPSE, SHAPE_CROSS, SHAPE_DOT = range(4)
+
+# Outline points of ellipses and dots
+CURVE_POINTS = 32
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--line-color', help='Line color in hex (e.g. #FF0000)')
     parser.add_argument('--bg-color', help='Background color in hex (e.g. #FFFFFF)')
+    parser.add_argument('--workers', type=int, help='Processes rendering animation frames or tiles (default: all cores)')
+    parser.add_argument('--tile-size', type=int, help='Render in square tiles of this size to bound memory')
+    parser.add_argument('--shape-type', type=int, choices=range(4), help='0 rectangle, 1 ellipse, 2 cross, 3 dot')
+    parser.add_argument('--format', choices=['png', 'svg'], help='Output format for still images (default: png)')
     return parser.parse_args()
 
 def calculate_brightness(pixel):
     return 0.299 * pixel[0] + 0.587 * pixel[1] + 0.114 * pixel[2]
 
 def quantize(value, step):
-    return step * math.floor((value / step) + 0.5)
-
-def get_weight(image, x, y, line_freq, width):
-    if 0 <= x < image.width and 0 <= y < image.height:
-        pixel = image.getpixel((x, y))
-        brightness = calculate_brightness(pixel)
-        quantized = quantize(brightness, 17)
-        return int(np.interp(quantized, [0, 255], [0, width / (line_freq * 2)]))
-    return 0
-
-class Shape:
-    def __init__(self, x, y, weight, color):
-        self.x = x
-        self.y = y
-        self.weight = weight
-        self.color = color
-        self.l = DEFAULT_SETTINGS['LINE_LENGTH']
-
-    def draw_rect(self, draw, angle):
-        angle_rad = math.radians(angle)
-        half_l = self.l / 2
-        half_w = self.weight / 2
-        
-        points = [
-            (self.x + half_l * math.cos(angle_rad) - half_w * math.sin(angle_rad),
-             self.y + half_l * math.sin(angle_rad) + half_w * math.cos(angle_rad)),
-            (self.x - half_l * math.cos(angle_rad) - half_w * math.sin(angle_rad),
-             self.y - half_l * math.sin(angle_rad) + half_w * math.cos(angle_rad)),
-            (self.x - half_l * math.cos(angle_rad) + half_w * math.sin(angle_rad),
-             self.y - half_l * math.sin(angle_rad) - half_w * math.cos(angle_rad)),
-            (self.x + half_l * math.cos(angle_rad) + half_w * math.sin(angle_rad),
-             self.y + half_l * math.sin(angle_rad) - half_w * math.cos(angle_rad))
-        ]
-        
-        if all(0 <= p[0] < draw.im.size[0] and 0 <= p[1] < draw.im.size[1] for p in points):
-            draw.polygon(points, fill=self.color)
+    return step * np.floor((value / step) + 0.5)
+
+def sample_grid(image, line_freq, width, height):
+    """Sample the weight and color of every grid point from one strided slice of the image.
+    
+    Returns x, y, weight and color arrays in column-by-column grid order. A
+    point's weight is its quantized brightness mapped onto [0, width / (2 * line_freq)].
+    """
+    step_x, step_y = int(width / line_freq), int(height / line_freq)
+    grid = np.asarray(image)[::step_y, ::step_x].swapaxes(0, 1)
+    
+    xs, ys = np.meshgrid(np.arange(0, width, step_x), np.arange(0, height, step_y), indexing='ij')
+    brightness = calculate_brightness(grid.transpose(2, 0, 1))
+    weights = np.interp(quantize(brightness, 17), [0, 255], [0, width / (line_freq * 2)]).astype(int)
+    colors = grid.reshape(-1, grid.shape[2])
+    return xs.ravel(), ys.ravel(), weights.ravel(), colors
+
+def compute_quads(xs, ys, weights, length, angle):
+    """Corner points of every line quad in one broadcast.
+    
+    Returns an (n, 4, 2) float array of (x, y) corners in drawing order.
+    """
+    angle_rad = math.radians(angle)
+    cos, sin = math.cos(angle_rad), math.sin(angle_rad)
+    half_l = length / 2
+    half_w = weights / 2
+    
+    quads = np.empty((len(xs), 4, 2))
+    quads[:, 0, 0] = xs + half_l * cos - half_w * sin
+    quads[:, 0, 1] = ys + half_l * sin + half_w * cos
+    quads[:, 1, 0] = xs - half_l * cos - half_w * sin
+    quads[:, 1, 1] = ys - half_l * sin + half_w * cos
+    quads[:, 2, 0] = xs - half_l * cos + half_w * sin
+    quads[:, 2, 1] = ys - half_l * sin - half_w * cos
+    quads[:, 3, 0] = xs + half_l * cos + half_w * sin
+    quads[:, 3, 1] = ys + half_l * sin - half_w * cos
+    return quads
+
+def compute_shapes(xs, ys, weights, length, angle, shape_type):
+    """Outline polygons of every shape, as an (n, parts, points, 2) float array.
+    
+    Rectangles are compute_quads exactly. Ellipses fill the same rectangle,
+    crosses add the rectangle turned by 90 degrees and dots are circles of the
+    line weight, so every type takes its size from the sampled weight.
+    """
+    if shape_type == SHAPE_RECT:
+        return compute_quads(xs, ys, weights, length, angle)[:, None]
+    if shape_type == SHAPE_CROSS:
+        return np.stack([compute_quads(xs, ys, weights, length, angle),
+                         compute_quads(xs, ys, weights, length, angle + 90)], axis=1)
+    
+    angle_rad = math.radians(angle)
+    t = np.linspace(0, 2 * math.pi, CURVE_POINTS, endpoint=False)
+    half_l = length / 2 if shape_type == SHAPE_ELLIPSE else weights[:, None] / 2
+    half_w = weights[:, None] / 2
+    u, v = half_l * np.cos(t), half_w * np.sin(t)
+    
+    shapes = np.empty((len(xs), 1, CURVE_POINTS, 2))
+    shapes[:, 0, :, 0] = xs[:, None] + u * math.cos(angle_rad) - v * math.sin(angle_rad)
+    shapes[:, 0, :, 1] = ys[:, None] + u * math.sin(angle_rad) + v * math.cos(angle_rad)
+    return shapes
+
+def visible_shapes(shapes, width, height):
+    """Mask of shapes whose points all lie on a width x height canvas; the others are not drawn"""
+    x, y = shape_points(shapes).transpose(2, 0, 1)
+    return ((x >= 0) & (x < width) & (y >= 0) & (y < height)).all(axis=1)
+
+def shape_points(shapes):
+    """All outline points of each shape as an (n, points, 2) array, also when there are no shapes"""
+    return shapes.reshape(len(shapes), shapes.shape[1] * shapes.shape[2], 2)
+
+@functools.lru_cache(maxsize=1024)
+def get_stamp(geometry, shape, size):
+    """Rasterize shape polygons given as raw float bytes once; returns the (rows, columns) of their pixels"""
+    mask = Image.new('1', (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    # Zero-weight polygons still come out as 1px lines, as on the full canvas
+    for polygon in np.frombuffer(geometry).reshape(shape):
+        draw.polygon(polygon.ravel().tolist(), fill=1)
+    return np.nonzero(np.asarray(mask))
+
+def render_shapes(pixels, shapes, xs, ys, colors):
+    """Composite every on-canvas shape onto an RGBA array in draw order, by blitting cached stamps.
+    
+    Each stamp is keyed by its shape's polygons relative to a whole-pixel
+    origin. Subtracting a non-negative whole number is exact in floating
+    point, so a stamp fills exactly the pixels drawing the shape in place
+    would, while shapes with the same weight and angle share one stamp.
+    """
+    height, width = pixels.shape[:2]
+    inside = visible_shapes(shapes, width, height)
+    shapes, colors = shapes[inside], np.asarray(colors)[inside]
+    if not len(shapes):
+        return
+    centers = np.stack([xs[inside], ys[inside]], axis=1)
+    reach = int(np.ceil(np.abs(shapes - centers[:, None, None]).max())) + 1
+    origins = np.maximum(centers - reach, 0)
+    local = np.ascontiguousarray((shapes - origins[:, None, None]).reshape(len(shapes), -1))
+    
+    # Comparing raw bytes is much faster than np.unique(axis=0) on float rows
+    stamps, stamp_ids = np.unique(local.view(np.dtype((np.void, local.shape[1] * 8))).ravel(),
+                                  return_inverse=True)
+    order = np.argsort(stamp_ids, kind='stable')
+    bounds = np.searchsorted(stamp_ids[order], np.arange(len(stamps) + 1))
+    
+    # Where shapes overlap, the one drawn last (the highest index) wins
+    top = np.full(height * width, -1)
+    for index, geometry in enumerate(stamps):
+        rows, columns = get_stamp(geometry.tobytes(), shapes.shape[1:], 2 * reach + 2)
+        members = order[bounds[index]:bounds[index + 1]]
+        y = origins[members, 1, None] + rows
+        x = origins[members, 0, None] + columns
+        on_canvas = (y < height) & (x < width)
+        np.maximum.at(top, (y * width + x)[on_canvas], np.broadcast_to(members[:, None], y.shape)[on_canvas])
+    
+    drawn = top >= 0
+    fill = colors[top[drawn]]
+    if fill.shape[1] == 3:
+        fill = np.column_stack([fill, np.full(len(fill), 255)])
+    pixels.reshape(-1, pixels.shape[2])[drawn] = fill
+
+def bin_shapes(shapes, tile_size, tiles_x, tiles_y):
+    """Spatial bin index of the tiles each shape's bounding box overlaps.
+    
+    Returns (shape_ids, offsets): tile t draws shape_ids[offsets[t]:offsets[t + 1]],
+    which keeps the original draw order within every tile.
+    """
+    points = shape_points(shapes)
+    # One pixel of slack, since PIL may round an edge onto the neighbouring pixel
+    lo = np.floor((points.min(axis=1) - 1) / tile_size).astype(int).clip(0, [tiles_x - 1, tiles_y - 1])
+    hi = np.floor((points.max(axis=1) + 1) / tile_size).astype(int).clip(0, [tiles_x - 1, tiles_y - 1])
+    nx = hi[:, 0] - lo[:, 0] + 1
+    counts = nx * (hi[:, 1] - lo[:, 1] + 1)
+    
+    shape_ids = np.repeat(np.arange(len(shapes)), counts)
+    k = np.arange(len(shape_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_ids = ((lo[shape_ids, 1] + k // nx[shape_ids]) * tiles_x
+                + lo[shape_ids, 0] + k % nx[shape_ids])
+    order = np.argsort(tile_ids, kind='stable')
+    offsets = np.searchsorted(tile_ids[order], np.arange(tiles_x * tiles_y + 1))
+    return shape_ids[order], offsets
+
+def render_tile(shapes, centers, colors, origin, size, margin, canvas_size, background):
+    """Render the shapes touching one tile and return its (height, width, 4) pixels.
+    
+    The tile is drawn on a canvas reaching margin pixels further, clamped to the
+    full canvas, so none of its shapes is clipped: PIL fills clipped polygons
+    slightly differently at the cut. Shapes are shifted by subtracting a
+    non-negative whole offset, which is exact in floating point.
+    """
+    tx, ty = origin
+    tw, th = size
+    left, top = max(tx - margin, 0), max(ty - margin, 0)
+    right, bottom = min(tx + tw + margin, canvas_size[0]), min(ty + th + margin, canvas_size[1])
+    
+    pixels = np.array(Image.new('RGBA', (right - left, bottom - top), background))
+    render_shapes(pixels, shapes - (left, top), centers[:, 0] - left, centers[:, 1] - top, colors)
+    return pixels[ty - top:ty - top + th, tx - left:tx - left + tw]
+
+def render_tiled(grid, angle, size, settings, path, workers=None):
+    """Render a still tile by tile and stream it to a PNG, one row of tiles at a time.
+    
+    Peak memory is a row of tiles plus the shape arrays, however large the canvas.
+    """
+    width, height = size
+    tile_size = settings['TILE_SIZE']
+    tiles_x, tiles_y = -(-width // tile_size), -(-height // tile_size)
+    
+    xs, ys, weights, colors = grid
+    shapes = compute_shapes(xs, ys, weights, settings['LINE_LENGTH'], angle, settings['SHAPE_TYPE'])
+    inside = visible_shapes(shapes, width, height)
+    shapes, colors = shapes[inside], np.asarray(colors)[inside]
+    centers = np.stack([xs[inside], ys[inside]], axis=1)
+    points = shape_points(shapes)
+    margin = int(np.ceil((points.max(axis=1) - points.min(axis=1)).max(initial=0))) + 2
+    shape_ids, offsets = bin_shapes(shapes, tile_size, tiles_x, tiles_y)
+    print(f"Rendering {tiles_x}x{tiles_y} tiles of {tile_size}px")
+    
+    def tile_jobs(row):
+        for column in range(tiles_x):
+            ids = shape_ids[offsets[row * tiles_x + column]:offsets[row * tiles_x + column + 1]]
+            origin = (column * tile_size, row * tile_size)
+            tile = (min(tile_size, width - origin[0]), min(tile_size, height - origin[1]))
+            yield shapes[ids], centers[ids], colors[ids], origin, tile, margin, size, settings['BACKGROUND_COLOR']
+    
+    def bands():
+        if workers == 1:
+            for row in range(tiles_y):
+                yield np.concatenate([render_tile(*job) for job in tile_jobs(row)], axis=1)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Keep the next row of tiles rendering while the current one is written
+            pending = deque([[pool.submit(render_tile, *job) for job in tile_jobs(0)]])
+            for row in range(tiles_y):
+                if row + 1 < tiles_y:
+                    pending.append([pool.submit(render_tile, *job) for job in tile_jobs(row + 1)])
+                yield np.concatenate([future.result() for future in pending.popleft()], axis=1)
+    
+    write_png(path, width, height, 4, bands())
+
+def svg_paths(shapes, weights, colors):
+    """Yield one SVG path element per run of consecutive shapes sharing a color.
+    
+    Runs keep the draw order, so overlaps stack as in the raster. Zero-weight
+    shapes, which PIL draws as 1px lines, have their outline stroked instead.
+    """
+    if not len(shapes):
+        return
+    lines = weights == 0
+    starts = np.flatnonzero(np.concatenate([[True], (colors[1:] != colors[:-1]).any(axis=1)
+                                            | (lines[1:] != lines[:-1])]))
+    ends = np.append(starts[1:], len(shapes))
+    parts, count = shapes.shape[1:3]
+    subpath = 'M{:.10g} {:.10g}L' + ' '.join(['{:.10g} {:.10g}'] * (count - 1)) + 'Z'
+    # Hundredths of a pixel are finer than any print resolution needs
+    points = np.round(shapes, 2).reshape(len(shapes), -1).tolist()
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        d = ''.join((subpath * parts).format(*p) for p in points[start:end])
+        paint = 'stroke' if lines[start] else 'fill'
+        yield f'<path {paint}="{svg_color(colors[start])}" d="{d}"/>\n'
+
+def svg_color(color):
+    """Hex notation of an RGB(A) color, ignoring alpha"""
+    return '#{:02x}{:02x}{:02x}'.format(*color[:3])
+
+def write_svg(path, grid, angle, size, settings, chunk_size=1 << 16):
+    """Write the shapes of one still as SVG paths, streamed to disk in chunks of about chunk_size characters"""
+    width, height = size
+    xs, ys, weights, colors = grid
+    shapes = compute_shapes(xs, ys, weights, settings['LINE_LENGTH'], angle, settings['SHAPE_TYPE'])
+    inside = visible_shapes(shapes, width, height)
+    
+    background = settings['BACKGROUND_COLOR']
+    if isinstance(background, str):
+        background = ImageColor.getrgb(background)
+    opacity = f' fill-opacity="{background[3] / 255:.3g}"' if len(background) > 3 else ''
+    
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                f'viewBox="0 0 {width} {height}">\n')
+        f.write(f'<rect width="100%" height="100%" fill="{svg_color(background)}"{opacity}/>\n')
+        # Round caps keep zero-weight dots visible as 1px points
+        f.write('<g stroke-width="1" stroke-linecap="round">\n')
+        chunk, chunk_length = [], 0
+        for element in svg_paths(shapes[inside], weights[inside], np.asarray(colors)[inside]):
+            chunk.append(element)
+            chunk_length += len(element)
+            if chunk_length >= chunk_size:
+                f.write(''.join(chunk))
+                chunk, chunk_length = [], 0
+        f.write(''.join(chunk))
+        f.write('</g>\n</svg>\n')
+
+def get_grid(image, settings):
+    """Sample the grid of an RGB image, applying LINE_COLOR if set"""
+    width, height = image.size
+    xs, ys, weights, colors = sample_grid(image, settings['LINE_FREQ'], width, height)
+    if settings['LINE_COLOR']:
+        colors = np.broadcast_to(settings['LINE_COLOR'], (len(xs), len(settings['LINE_COLOR'])))
+    return xs, ys, weights, colors
+
+def render_frame(grid, angle, size, settings):
+    """Render one sampled grid at the given line angle into a new RGBA image"""
+    pixels = np.array(Image.new('RGBA', size, settings['BACKGROUND_COLOR']))
+    xs, ys, weights, colors = grid
+    shapes = compute_shapes(xs, ys, weights, settings['LINE_LENGTH'], angle, settings['SHAPE_TYPE'])
+    render_shapes(pixels, shapes, xs, ys, colors)
+    return Image.fromarray(pixels)
+
+def load_input_grids(image, settings):
+    """Sample every input frame, reusing the previous grid when a frame repeats unchanged.
+    
+    Returns a list of (grid, duration in ms); a still image yields a single entry.
+    """
+    frames = ImageSequence.Iterator(image) if settings['ANIMATED_INPUT'] else [image]
+    grids = []
+    previous = None
+    for frame in frames:
+        if settings['INPUT_FRAMES'] and len(grids) >= settings['INPUT_FRAMES']:
+            break
+        pixels = np.asarray(frame.convert('RGB'))
+        if previous is None or not np.array_equal(pixels, previous):
+            grid = get_grid(Image.fromarray(pixels), settings)
+            previous = pixels
+        grids.append((grid, frame.info.get('duration', 40)))
+    return grids
+
+def render_frames(grids, size, settings, workers=None):
+    """Yield the frames of the animation in order, rendered in parallel.
+    
+    Output frame i draws input frame i modulo the input length. With FRAMES > 1
+    LINE_ANGLE turns by 180 degrees over the loop, which brings the lines back
+    to their starting position. Only a few frames are in flight at once, so
+    memory does not grow with the frame count.
+    """
+    total = max(settings['FRAMES'], len(grids))
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        window = 2 * workers
+        for index in range(total):
+            angle = settings['LINE_ANGLE']
+            if settings['FRAMES'] > 1:
+                angle += 180 * index / total
+            grid, _ = grids[index % len(grids)]
+            pending.append(pool.submit(render_frame, grid, angle, size, settings))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def save_animation(image, settings, workers=None):
+    """Render and stream an animation to done/ as numbered PNGs (SAVE_FRAMES) or an animated GIF"""
+    grids = load_input_grids(image, settings)
+    total = max(settings['FRAMES'], len(grids))
+    print(f"Rendering {total} frames from {len(grids)} input frames")
+    
+    name = os.path.splitext(settings['IMAGE_NAME'])[0]
+    frames = render_frames(grids, image.size, settings, workers)
+    os.makedirs("done", exist_ok=True)
+    if settings['SAVE_FRAMES']:
+        directory = os.path.join("done", name)
+        os.makedirs(directory, exist_ok=True)
+        for index, frame in enumerate(frames):
+            frame.save(os.path.join(directory, f"frame_{index:05d}.png"))
+        print(f"Frames saved to {directory}/")
+    else:
+        path = os.path.join("done", f"{name}.gif")
+        # Output frame i shows input frame i modulo the input length, for that frame's duration
+        durations = (grids[index % len(grids)][1] for index in range(total))
+        write_gif(path, zip(frames, durations))
+        print(f"Animation saved to {path}")
 
 def main():
     args = parse_args()
@@ -81,24 +394,38 @@ def main():
         settings['LINE_COLOR'] = hex_to_rgb(args.line_color)
     if args.bg_color:
         settings['BACKGROUND_COLOR'] = hex_to_rgb(args.bg_color) + (0,)  # Add alpha channel
+    if args.tile_size:
+        settings['TILE_SIZE'] = args.tile_size
+    if args.format:
+        settings['OUTPUT_FORMAT'] = args.format
+    if args.shape_type is not None:
+        settings['SHAPE_TYPE'] = args.shape_type
     
-    image = Image.open(settings['IMAGE_NAME']).convert('RGB')
+    image = Image.open(settings['IMAGE_NAME'])
     width, height = image.size
     print(f"Image dimensions: {width}x{height}px")
     print(f"Line spacing: {width/settings['LINE_FREQ']:.1f}px | Line length: {settings['LINE_LENGTH']}px")
     
-    output = Image.new('RGBA', (width, height), settings['BACKGROUND_COLOR'])
-    draw = ImageDraw.Draw(output)
+    if settings['ANIMATED_INPUT'] or settings['FRAMES'] > 1:
+        save_animation(image, settings, args.workers)
+        return
+    
+    grid = get_grid(image.convert('RGB'), settings)
+    if settings['OUTPUT_FORMAT'] == 'svg':
+        os.makedirs("done", exist_ok=True)
+        path = os.path.join("done", os.path.splitext(settings['IMAGE_NAME'])[0] + ".svg")
+        write_svg(path, grid, settings['LINE_ANGLE'], (width, height), settings)
+        print(f"Output saved to {path}")
+        return
     
-    lines = []
-    for x in range(0, width, int(width / settings['LINE_FREQ'])):
-        for y in range(0, height, int(height / settings['LINE_FREQ'])):
-            weight = get_weight(image, x, y, settings['LINE_FREQ'], width)
-            color = settings['LINE_COLOR'] or image.getpixel((x, y))
-            lines.append(Shape(x, y, weight, color))
+    if settings['TILE_SIZE']:
+        os.makedirs("done", exist_ok=True)
+        path = os.path.join("done", os.path.splitext(settings['IMAGE_NAME'])[0] + ".png")
+        render_tiled(grid, settings['LINE_ANGLE'], (width, height), settings, path, args.workers)
+        print(f"Output saved to {path}")
+        return
     
-    for line in lines:
-        line.draw_rect(draw, settings['LINE_ANGLE'])
+    output = render_frame(grid, settings['LINE_ANGLE'], (width, height), settings)
     
     os.makedirs("done", exist_ok=True)
     output.save(os.path.join("done", settings['IMAGE_NAME']))
@@ -1,52 +1,533 @@
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
 import numpy as np
+import argparse
+import contextlib
+import functools
+import glob
+import hashlib
+import io
+import math
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
+
+from streaming import write_gif, write_png
+
+ENGINES = ("scan", "vectorized")
+SORT_KEYS = (None, "luma", "hue", "saturation", "product")
+
+# Attributes that decide the sorted output, handed to worker processes
+SETTINGS = ("engine", "sort_key", "mode", "white_value", "black_value", "bright_value", "dark_value",
+            "edge_value")
+
+# Threshold attribute read by each sorting mode
+THRESHOLDS = ("white_value", "black_value", "bright_value", "dark_value", "edge_value")
+
+# Mode whose intervals are bounded by edges of the input image
+EDGE_MODE = 4
+
+# Fixed-point scale of the hue and saturation sort keys of 8-bit pixels
+FIXED_POINT_SCALE = 1 << 17
+
+# Memory budget of a background full-resolution preview job
+PREVIEW_BUDGET = 256 * 1024 ** 2
+
+# Rough peak working memory of a vectorized pass, as a multiple of the pixel bytes it sorts
+STREAM_OVERHEAD = 32
+
+class SortCancelled(Exception):
+    """Raised inside a sort whose cancel_event was set"""
 
 class PixelSorter:
-    def __init__(self):
-        # Sorting modes: 0=white, 1=black, 2=bright, 3=dark
+    def __init__(self, engine="scan", sort_key=None, workers=1, pixels=None, memory_budget=None,
+                 img_filename="mountains", file_type="png", angle=None, cache=None):
+        # Sorting modes: 0=white, 1=black, 2=bright, 3=dark, 4=edge
         self.mode = 0
         
+        # Interval engine: "scan" walks pixels one at a time, "vectorized" masks whole passes
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        self.engine = engine
+        
+        # Whole-pixel ordering key; None sorts each channel independently
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort_key!r}, expected one of {SORT_KEYS}")
+        self.sort_key = sort_key
+        
+        # Number of processes sharing the column and row passes
+        self.workers = max(1, workers)
+        
+        # Byte budget for out-of-core sorting; None keeps the whole image in memory
+        self.memory_budget = memory_budget
+        self.raw_file = None
+        
+        # Streak direction in degrees (0 = rows); None keeps the column then row passes
+        self.angle = angle
+        
+        # ResultCache reused across runs with the same pixels and settings
+        self.cache = cache
+        
         # Image path and type
-        self.img_filename = "mountains"
-        self.file_type = "png"
+        self.img_filename = img_filename
+        self.file_type = file_type
         
         # Threshold values
         self.white_value = 100 # Better balance for white sorting
         self.black_value = -1000000  # More reasonable threshold for black detection
         self.bright_value = 127
         self.dark_value = 223
+        self.edge_value = 100  # Sobel gradient magnitude of luma that ends an interval
         
         # State variables
         self.row = 0
         self.column = 0
         self.saved = False
         self.loops = 1
+        self.cancel_event = None  # threading.Event checked between strips of a streaming sort
+        
+        # Load image, unless an array to sort in place was given
+        if pixels is None:
+            if memory_budget is None:
+                self.img = Image.open(f"{self.img_filename}.{self.file_type}")
+                self.pixels = np.array(self.img)
+            else:
+                self.pixels = self.load_memmap(f"{self.img_filename}.{self.file_type}")
+                self.img = None
+        else:
+            self.img = None
+            self.pixels = pixels
+        self.height, self.width = self.pixels.shape[:2]
         
-        # Load image
-        self.img = Image.open(f"{self.img_filename}.{self.file_type}")
-        self.pixels = np.array(self.img)
-        self.width, self.height = self.img.size
+        # Per-pixel threshold keys for the vectorized engine, kept in step with self.pixels
+        self.key_plane = None
+        self.key_kind = None
     
     def run(self):
-        for _ in range(self.loops):
-            print("Sorting Columns")
-            while self.column < self.width - 1:
-                self.sort_column()
-                self.column += 1
-            
-            print("Sorting Rows")
-            while self.row < self.height - 1:
-                self.sort_row()
-                self.row += 1
+        if self.cache is not None:
+            self.sort_cached()
+        else:
+            self.sort_all()
         
         # Save result
         if not self.saved:
-            output_img = Image.fromarray(self.pixels)
-            output_img.save(f"{self.img_filename}_{self.mode}.png")
+            if self.memory_budget is not None:
+                channels = self.pixels.shape[2]
+                band = self.get_band_size(self.width * channels, self.height)
+                write_png(f"{self.img_filename}_{self.mode}.png", self.width, self.height, channels,
+                          (self.pixels[y:y + band] for y in range(0, self.height, band)))
+            else:
+                output_img = Image.fromarray(self.pixels)
+                output_img.save(f"{self.img_filename}_{self.mode}.png")
             self.saved = True
             print("Image saved")
     
+    def sort_all(self):
+        """Run every loop of the configured passes"""
+        for _ in range(self.loops):
+            if self.angle is not None:
+                self.sort_angles()
+                continue
+            if self.memory_budget is not None:
+                self.sort_streaming()
+                continue
+            if self.workers > 1:
+                self.sort_parallel()
+                continue
+            
+            print("Sorting Columns")
+            self.sort_columns()
+            
+            print("Sorting Rows")
+            self.sort_rows()
+    
+    def sort_cached(self):
+        """Sort through self.cache, reusing a stored result of the same pixels and settings"""
+        digest = hashlib.blake2b(np.ascontiguousarray(self.pixels), digest_size=16)
+        digest.update(f"{self.pixels.shape}{self.pixels.dtype}".encode())
+        key = self.get_cache_key(digest.hexdigest())
+        
+        result = self.cache.get(key)
+        if result is not None:
+            print("Loaded result from cache")
+            self.load_cached(result)
+            return
+        
+        self.sort_all()
+        self.cache.put(key, self.pixels)
+    
+    def load_cached(self, pixels):
+        """Take over a cached array as the sorted image"""
+        self.pixels[...] = pixels
+        self.key_plane = None
+        self.key_kind = None
+        self.column = max(self.column, self.width - 1)
+        self.row = max(self.row, self.height - 1)
+    
+    def get_cache_key(self, digest):
+        """Cache key of this run: input digest plus every setting that changes the output"""
+        # Engines and worker counts give identical output, so they stay out of the key
+        settings = (self.mode, getattr(self, THRESHOLDS[self.mode]), self.sort_key,
+                    self.angle, self.loops, self.column, self.row)
+        return hashlib.blake2b(f"{digest}{settings!r}".encode(), digest_size=16).hexdigest()
+    
+    def sort_angles(self):
+        """Sort lines perpendicular to angle, then along angle, like the column and row passes"""
+        for angle in (self.angle + 90, self.angle):
+            print(f"Sorting lines at {angle % 180:g} degrees")
+            self.sort_angle(angle)
+        self.column = max(self.column, self.width - 1)
+        self.row = max(self.row, self.height - 1)
+    
+    def sort_angle(self, angle):
+        """Sort every line of the image running at angle with one gather and one scatter"""
+        order, counts = get_line_map(self.width, self.height, angle)
+        flat = self.pixels.reshape(-1, self.pixels.shape[2])
+        flat_keys = self.get_key_plane().reshape(-1)
+        
+        # Pad the lines to a common length; a boolean mask walks them in line order
+        valid = np.arange(counts.max()) < counts[:, None]
+        lines = np.zeros(valid.shape + flat.shape[1:], dtype=flat.dtype)
+        keys = np.zeros(valid.shape, dtype=flat_keys.dtype)
+        lines[valid] = flat[order]
+        keys[valid] = flat_keys[order]
+        self.sort_lines(lines, keys, valid)
+        
+        flat[order] = lines[valid]
+        flat_keys[order] = keys[valid]
+        # reshape copies non-contiguous arrays, so keep whatever was written to
+        self.pixels = flat.reshape(self.pixels.shape)
+        self.key_plane = flat_keys.reshape(self.key_plane.shape)
+    
+    def sort_parallel(self):
+        """Sort columns, then rows, in shards across a process pool.
+        
+        The image is copied once into shared memory; workers sort their shard of
+        it in place, so only shard bounds and settings are pickled. All column
+        shards finish before any row shard starts.
+        """
+        self.check_whole_image("workers")
+        settings = self.get_settings()
+        shm = shared_memory.SharedMemory(create=True, size=self.pixels.nbytes)
+        try:
+            shared = np.ndarray(self.pixels.shape, dtype=self.pixels.dtype, buffer=shm.buf)
+            shared[:] = self.pixels
+            task = (shm.name, self.pixels.shape, self.pixels.dtype.str, settings)
+            
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                print("Sorting Columns")
+                list(pool.map(sort_shard, *zip(*self.get_shards(task, 0, self.column, self.width - 1))))
+                self.column = max(self.column, self.width - 1)
+                
+                print("Sorting Rows")
+                list(pool.map(sort_shard, *zip(*self.get_shards(task, 1, self.row, self.height - 1))))
+                self.row = max(self.row, self.height - 1)
+            
+            self.pixels[:] = shared
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+        
+        # Workers sorted behind the key plane's back
+        self.key_plane = None
+        self.key_kind = None
+    
+    def sort_streaming(self):
+        """Sort columns in vertical strips, then rows in horizontal bands, within memory_budget.
+        
+        Each strip is copied out of the disk-backed image, sorted and written back,
+        so resident memory stays around one strip plus its sorting temporaries.
+        """
+        self.check_whole_image("memory_budget")
+        settings = self.get_settings()
+        pixel_bytes = self.pixels.shape[2] * self.pixels.itemsize
+        
+        print("Sorting Columns")
+        strip = self.get_band_size(self.height * pixel_bytes, self.width)
+        for start in range(self.column, self.width - 1, strip):
+            self.check_cancelled()
+            stop = min(start + strip, self.width - 1)
+            # One extra column so the strip's last column is not treated as the image edge
+            block = np.array(self.pixels[:, start:stop + 1])
+            sort_view(block, settings, 0)
+            self.pixels[:, start:stop] = block[:, :-1]
+        self.column = max(self.column, self.width - 1)
+        
+        print("Sorting Rows")
+        band = self.get_band_size(self.width * pixel_bytes, self.height)
+        for start in range(self.row, self.height - 1, band):
+            self.check_cancelled()
+            stop = min(start + band, self.height - 1)
+            block = np.array(self.pixels[start:stop + 1])
+            sort_view(block, settings, 1)
+            self.pixels[start:stop] = block[:-1]
+        self.row = max(self.row, self.height - 1)
+        
+        if isinstance(self.pixels, np.memmap):
+            self.pixels.flush()
+    
+    def check_whole_image(self, option):
+        """Reject edge mode for paths that only ever see part of the image"""
+        if self.mode == EDGE_MODE:
+            raise ValueError(f"Edge mode needs the whole image and cannot be used with {option}")
+    
+    def check_cancelled(self):
+        """Stop a sort whose cancel_event has been set"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise SortCancelled()
+    
+    def load_memmap(self, path):
+        """Decode the image at path into a temporary disk-backed array, copying it over in bands.
+        
+        Images this large trip PIL's decompression bomb check, so the pixel limit
+        is lifted while opening. PIL still decodes the whole image into memory
+        once before the bands are copied, so loading peaks at the full decoded
+        size; only the sort afterwards stays within memory_budget.
+        """
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            with Image.open(path) as img:
+                width, height = img.size
+                channels = len(img.getbands())
+                self.raw_file = tempfile.NamedTemporaryFile(prefix=f"{self.img_filename}_", suffix=".raw")
+                pixels = np.memmap(self.raw_file, dtype=np.uint8, mode="w+", shape=(height, width, channels))
+                
+                band = self.get_band_size(width * channels, height)
+                for y in range(0, height, band):
+                    pixels[y:y + band] = np.asarray(img.crop((0, y, width, min(y + band, height))))
+            # Leaving the block releases PIL's decoded copy once the raw file holds the pixels
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        return pixels
+    
+    def get_band_size(self, line_bytes, count):
+        """Number of lines of line_bytes each that fit in memory_budget"""
+        return max(1, min(count, self.memory_budget // (line_bytes * STREAM_OVERHEAD)))
+    
+    def get_settings(self):
+        """Collect the attributes that decide the sorted output"""
+        return {name: getattr(self, name) for name in SETTINGS}
+    
+    def get_shards(self, task, axis, start, stop):
+        """Split lines [start, stop) into one contiguous shard per worker"""
+        bounds = np.linspace(start, stop, self.workers + 1).astype(int)
+        return [task + (axis, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    
+    def sort_columns(self):
+        """Sort every remaining column with the selected engine"""
+        # The scanners have no edge mode, so it always takes the vectorized path
+        if self.engine == "vectorized" or self.mode == EDGE_MODE:
+            if self.column < self.width - 1:
+                keys = self.get_key_plane()
+                self.sort_lines(self.pixels[:, self.column:self.width - 1].swapaxes(0, 1),
+                                keys[:, self.column:self.width - 1].swapaxes(0, 1))
+                self.column = self.width - 1
+            return
+        while self.column < self.width - 1:
+            self.sort_column()
+            self.column += 1
+    
+    def sort_rows(self):
+        """Sort every remaining row with the selected engine"""
+        if self.engine == "vectorized" or self.mode == EDGE_MODE:
+            if self.row < self.height - 1:
+                keys = self.get_key_plane()
+                self.sort_lines(self.pixels[self.row:self.height - 1],
+                                keys[self.row:self.height - 1])
+                self.row = self.height - 1
+            return
+        while self.row < self.height - 1:
+            self.sort_row()
+            self.row += 1
+    
+    def sort_lines(self, lines, keys, valid=None):
+        """Sort all intervals of a (lines, length, channels) view in place.
+        
+        Every interval of the pass is gathered into one array, sorted in a single
+        segmented sort and scattered back, instead of one np.sort call per interval.
+        keys is the matching (lines, length) view of the key plane; only the
+        entries of sorted pixels are refreshed, from the values already gathered.
+        valid optionally marks the real pixels of lines padded to a common length.
+        """
+        line_idx, starts, ends = self.find_intervals(lines, keys, valid)
+        if len(starts) == 0:
+            return
+        seg_ids, rows, cols = self.expand_intervals(line_idx, starts, ends)
+        values = lines[rows, cols]
+        # The edge map belongs to the input image and stays where it is
+        track_keys = self.key_kind != "edge"
+        if self.sort_key is None:
+            values = self.sort_segments(values, seg_ids)
+            if track_keys:
+                keys[rows, cols] = self.compute_keys(values, self.key_kind)
+        else:
+            # Whole pixels move, so their threshold keys move with them
+            order = self.order_segments(values, seg_ids)
+            values = values[order]
+            if track_keys:
+                keys[rows, cols] = keys[rows, cols][order]
+        lines[rows, cols] = values
+    
+    def expand_intervals(self, line_idx, starts, ends):
+        """Turn [start, end) spans into per-pixel segment ids and line/position coordinates"""
+        lengths = ends - starts
+        seg_ids = np.repeat(np.arange(len(starts)), lengths)
+        # Position of each pixel within its own segment
+        offsets = np.arange(len(seg_ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return seg_ids, line_idx[seg_ids], starts[seg_ids] + offsets
+    
+    def order_segments(self, values, seg_ids):
+        """Stable order sorting (pixels, channels) values as whole pixels by sort_key within each segment"""
+        sort_values = self.compute_sort_values(values)
+        if sort_values.dtype.kind == "i" and sort_values.dtype.itemsize <= 4:
+            # Pack the segment id above the offset key so one sort orders both, far faster than lexsort
+            packed = (seg_ids.astype(np.int64) << 32) | (sort_values.astype(np.int64) + 2 ** 31)
+            return np.argsort(packed, kind="stable")
+        return np.lexsort((sort_values, seg_ids))
+    
+    def sort_segments(self, values, seg_ids):
+        """Sort each channel of (pixels, channels) values within its segment, like np.sort(segment, axis=0)"""
+        if values.dtype.kind == "u" and values.dtype.itemsize <= 2:
+            # Pack the segment id above the channel value so one plain sort orders both
+            bits = values.dtype.itemsize * 8
+            keys = (seg_ids.astype(np.int64)[:, None] << bits) | values
+            keys.sort(axis=0)
+            return (keys & ((1 << bits) - 1)).astype(values.dtype)
+        
+        result = np.empty_like(values)
+        for c in range(values.shape[1]):
+            result[:, c] = values[np.lexsort((values[:, c], seg_ids)), c]
+        return result
+    
+    def find_intervals(self, lines, keys, valid=None):
+        """Locate every sort interval of a (lines, length, channels) array at once.
+        
+        Matches the get_first_not_*/get_next_* scanners: an interval starts on a pixel
+        passing the start test and grows while the following pixels pass the continue
+        test. The last pixel of each run is left out of the sort, as the scanners do.
+        Returns (line index, start, end) arrays describing half-open [start, end) spans.
+        """
+        start_ok, cont_ok = self.get_interval_masks(lines, keys)
+        if valid is not None:
+            # Padding behaves like the image edge
+            start_ok &= valid
+            cont_ok &= valid
+        
+        # The continue test implies the start test, so a pixel extends an interval
+        # exactly when it passes the continue test and its predecessor passes the start test
+        inside = np.zeros_like(cont_ok)
+        inside[:, 1:] = cont_ok[:, 1:] & start_ok[:, :-1]
+        starts = start_ok & ~inside
+        ends = start_ok.copy()
+        ends[:, :-1] &= ~inside[:, 1:]
+        
+        length = lines.shape[1]
+        line_idx, start_pos = np.divmod(np.flatnonzero(starts), length)
+        end_pos = np.flatnonzero(ends) - line_idx * length
+        
+        keep = end_pos > start_pos
+        return line_idx[keep], start_pos[keep], end_pos[keep]
+    
+    def get_interval_masks(self, lines, keys):
+        """Evaluate the start and continue tests of the current mode for every pixel"""
+        if self.mode == EDGE_MODE:
+            # Intervals run through smooth areas and stop at edges
+            smooth = keys < self.edge_value
+            return smooth, smooth
+        if self.mode == 0:
+            return keys >= self.white_value, keys > self.white_value
+        if self.mode == 1:
+            return keys <= self.black_value, keys < self.black_value
+        
+        threshold = self.bright_value if self.mode == 2 else self.dark_value
+        above, equal = self.compare_luma(lines, keys, threshold)
+        if self.mode == 2:
+            return above | equal, above
+        return ~above, ~above & ~equal
+    
+    def compare_luma(self, lines, keys, threshold):
+        """Compare get_brightness against a threshold using the milli-luma key plane.
+        
+        The integer key decides every pixel more than 1/1000 away from the threshold;
+        the few pixels inside that band are re-evaluated with the float formula so ties
+        and rounding land exactly where get_brightness puts them.
+        Returns (brightness > threshold, brightness == threshold) masks.
+        """
+        scaled = threshold * 1000
+        above = keys > scaled
+        equal = np.zeros_like(above)
+        
+        band = np.abs(keys - scaled) <= 1
+        if band.any():
+            rgb = lines[band]
+            brightness = 0.299 * rgb[:, 0] + 0.587 * rgb[:, 1] + 0.114 * rgb[:, 2]
+            above[band] = brightness > threshold
+            equal[band] = brightness == threshold
+        return above, equal
+    
+    def get_key_plane(self):
+        """Return the key plane for the current mode, building it on first use"""
+        kind = ("product", "product", "luma", "luma", "edge")[self.mode]
+        if self.key_kind != kind:
+            self.key_plane = self.compute_keys(self.pixels, kind)
+            self.key_kind = kind
+        return self.key_plane
+    
+    def compute_keys(self, pixels, kind):
+        """Compute int32 keys: r*g*b ("product"), 1000x brightness ("luma") or edge strength ("edge")"""
+        if kind == "edge":
+            return compute_edge_map(pixels)
+        r = pixels[..., 0].astype(np.int32)
+        g = pixels[..., 1].astype(np.int32)
+        b = pixels[..., 2].astype(np.int32)
+        if kind == "product":
+            return r * g * b
+        # Exact integer form of get_brightness scaled by 1000
+        return 299 * r + 587 * g + 114 * b
+    
+    def compute_sort_values(self, pixels):
+        """Compute the sort_key value of every pixel in a (..., channels) array.
+        
+        Hue and saturation of 8-bit pixels come as exact int32 fixed point,
+        floor(FIXED_POINT_SCALE * value), from integer divisions, so they sort as fast
+        as the integer keys. Distinct values of 8-bit channels lie more than
+        1/65025 apart, so the scale keeps their order and ties.
+        """
+        if self.sort_key in ("luma", "product"):
+            return self.compute_keys(pixels, self.sort_key)
+        
+        if pixels.dtype == np.uint8:
+            rgb, scale, divide = pixels[..., :3].astype(np.int32), FIXED_POINT_SCALE, np.floor_divide
+        else:
+            rgb, scale, divide = pixels[..., :3].astype(np.float64), 1, np.true_divide
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+        # Pairwise maximum and minimum are far faster than reducing a 3-long axis
+        mx = np.maximum(np.maximum(r, g), b)
+        delta = mx - np.minimum(np.minimum(r, g), b)
+        if self.sort_key == "saturation":
+            # Black pixels have delta 0, so any non-zero divisor gives them 0
+            return divide(delta * scale, np.maximum(mx, 1)).astype(rgb.dtype, copy=False)
+        
+        # Hue in sextants [0, 6), grey pixels get 0
+        safe = np.where(delta > 0, delta, 1)
+        # Pick each pixel's sextant first so there is one division; only red's can wrap below 0
+        numerator = np.where(mx == r, g - b, np.where(mx == g, b - r, r - g))
+        sextant = np.where(mx == r, 0, np.where(mx == g, 2 * scale, 4 * scale))
+        hue = (divide(numerator * scale, safe) + sextant) % (6 * scale)
+        return np.where(delta > 0, hue, 0).astype(rgb.dtype, copy=False)
+    
+    def sort_segment(self, segment):
+        """Sort one (length, channels) segment per channel, or as whole pixels by sort_key"""
+        if self.sort_key is None:
+            return np.sort(segment, axis=0)
+        return segment[np.argsort(self.compute_sort_values(segment), kind="stable")]
+    
     def sort_row(self):
         y = self.row
         x = 0
@@ -76,7 +557,7 @@ class PixelSorter:
             
             # Extract and sort the pixel segment
             segment = self.pixels[y, x:x_end]
-            sorted_segment = np.sort(segment, axis=0)
+            sorted_segment = self.sort_segment(segment)
             self.pixels[y, x:x_end] = sorted_segment
             
             x = x_end + 1
@@ -110,7 +591,7 @@ class PixelSorter:
             
             # Extract and sort the pixel segment
             segment = self.pixels[y:y_end, x]
-            sorted_segment = np.sort(segment, axis=0)
+            sorted_segment = self.sort_segment(segment)
             self.pixels[y:y_end, x] = sorted_segment
             
             y = y_end + 1
@@ -249,6 +730,320 @@ class PixelSorter:
         r, g, b = self.pixels[y, x][:3]
         return 0.299 * r + 0.587 * g + 0.114 * b
 
+def compute_edge_map(pixels):
+    """Sobel gradient magnitude of the luma of a (height, width, channels) image as int32"""
+    luma = 0.299 * pixels[..., 0] + 0.587 * pixels[..., 1] + 0.114 * pixels[..., 2]
+    p = np.pad(luma, 1, mode="edge")
+    gx = (p[:-2, 2:] + 2 * p[1:-1, 2:] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[1:-1, :-2] + p[2:, :-2])
+    gy = (p[2:, :-2] + 2 * p[2:, 1:-1] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[:-2, 1:-1] + p[:-2, 2:])
+    return np.rint(np.hypot(gx, gy)).astype(np.int32)
+
+class PreviewSession:
+    """Tune settings on a downscaled copy, optionally finishing full resolution in the background.
+    
+    Thresholds compare single pixel values, so a box-filtered copy keeps their
+    meaning while holding scale**2 times fewer pixels. Each new preview cancels
+    the full-resolution job of the previous one.
+    """
+    def __init__(self, pixels, scale=4):
+        self.pixels = np.asarray(pixels)
+        self.small = np.array(Image.fromarray(self.pixels).reduce(scale))
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job = None
+        self.cancel_event = None
+    
+    def preview(self, settings=None, full_res=False):
+        """Return the sorted downscaled copy for settings, a dict of PixelSorter attributes"""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        settings = {"engine": "vectorized", **(settings or {})}
+        
+        sorter = make_sorter(settings, pixels=self.small.copy())
+        sorter.sort_all()
+        
+        if full_res:
+            self.cancel_event = threading.Event()
+            self.job = self.executor.submit(sort_full_res, self.pixels, settings, self.cancel_event)
+        return sorter.pixels
+    
+    def result(self, timeout=None):
+        """Wait for the latest full-resolution job; None if it was cancelled or never started"""
+        if self.job is None:
+            return None
+        try:
+            return self.job.result(timeout)
+        except SortCancelled:
+            return None
+    
+    def close(self):
+        """Cancel any running job and stop the background thread"""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        self.executor.shutdown(wait=True)
+
+def sort_full_res(pixels, settings, cancel_event):
+    """Sort a copy of pixels in bands so cancel_event can stop it between bands"""
+    # Edge mode needs the whole image at once, so it cannot stop between bands
+    budget = None if settings.get("mode") == EDGE_MODE else PREVIEW_BUDGET
+    sorter = make_sorter(settings, pixels=pixels.copy(), memory_budget=budget)
+    sorter.cancel_event = cancel_event
+    sorter.sort_all()
+    return sorter.pixels
+
+class ResultCache:
+    """Size-bounded on-disk store of sorted arrays, evicting the least recently used"""
+    def __init__(self, directory="pixelsort_cache", max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+    
+    def get(self, key):
+        """Return the array stored under key, or None"""
+        path = os.path.join(self.directory, f"{key}.npy")
+        try:
+            pixels = np.load(path)
+        except (OSError, ValueError):
+            return None
+        # The modification time doubles as the last-use time for eviction
+        os.utime(path)
+        return pixels
+    
+    def put(self, key, pixels):
+        """Store an array under key, then evict old entries beyond max_bytes"""
+        path = os.path.join(self.directory, f"{key}.npy")
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            np.save(f, np.asarray(pixels))
+        os.replace(f.name, path)
+        self.evict()
+    
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+@functools.lru_cache(maxsize=2)
+def get_line_map(width, height, angle):
+    """Rasterize a width x height image into parallel lines running at angle degrees.
+    
+    Every pixel is assigned to the line its centre projects onto across the
+    direction of travel and ordered by its projection along it. Returns the
+    int32 flat pixel indices of all lines one after another, plus the length
+    of each line. Results are read-only; the cache holds the two angles of one
+    angled run, at 4 bytes per pixel each.
+    """
+    theta = math.radians(angle)
+    cos, sin = math.cos(theta), math.sin(theta)
+    ys, xs = np.divmod(np.arange(width * height), width)
+    
+    across = np.rint(ys * cos - xs * sin).astype(np.int64)
+    along = xs * cos + ys * sin
+    order = np.lexsort((along, across)).astype(np.int32)
+    counts = np.unique(across, return_counts=True)[1]
+    
+    order.flags.writeable = False
+    counts.flags.writeable = False
+    return order, counts
+
+class SequenceSorter:
+    """Sort a sequence of frames, re-sorting only the lines that changed since the previous frame.
+    
+    A sorted column depends only on the same input column, and a sorted row only on
+    the same row after the column pass, so unchanged lines reuse the previous result.
+    """
+    def __init__(self, settings=None):
+        # PixelSorter attributes to override, e.g. {"mode": 2, "bright_value": 100}
+        self.settings = dict(settings or {})
+        self.settings["engine"] = "vectorized"
+        self.prev_input = None
+        self.prev_columns = None
+        self.prev_output = None
+    
+    def sort_frame(self, frame):
+        """Return the sorted version of the next frame"""
+        if self.settings.get("mode") == EDGE_MODE:
+            # An edge depends on neighbouring lines, so unchanged lines may still need sorting
+            raise ValueError("Edge mode cannot reuse lines between frames")
+        frame = np.asarray(frame)
+        height, width = frame.shape[:2]
+        
+        if self.prev_input is None or self.prev_input.shape != frame.shape:
+            columns = frame.copy()
+            dirty_cols = np.arange(width)
+        else:
+            columns = self.prev_columns.copy()
+            dirty_cols = np.flatnonzero((frame != self.prev_input).any(axis=(0, 2)))
+            columns[:, dirty_cols] = frame[:, dirty_cols]
+        # The last column and row are never sorted, only carried over
+        sort_cols = dirty_cols[dirty_cols < width - 1]
+        self.sort_subset(columns.swapaxes(0, 1), sort_cols)
+        
+        if self.prev_output is None or self.prev_output.shape != frame.shape:
+            output = columns.copy()
+            dirty_rows = np.arange(height)
+        else:
+            output = self.prev_output.copy()
+            dirty_rows = np.flatnonzero((columns != self.prev_columns).any(axis=(1, 2)))
+            output[dirty_rows] = columns[dirty_rows]
+        sort_rows = dirty_rows[dirty_rows < height - 1]
+        self.sort_subset(output, sort_rows)
+        
+        print(f"Re-sorted {len(sort_cols)}/{max(width - 1, 0)} columns, "
+              f"{len(sort_rows)}/{max(height - 1, 0)} rows")
+        self.prev_input = frame.copy()
+        self.prev_columns = columns
+        self.prev_output = output
+        return output
+    
+    def sort_subset(self, lines, indices):
+        """Sort the given lines of a (lines, length, channels) view in place"""
+        if len(indices) == 0:
+            return
+        subset = np.ascontiguousarray(lines[indices])
+        sorter = make_sorter(self.settings, pixels=subset)
+        sorter.sort_lines(subset, sorter.get_key_plane())
+        lines[indices] = subset
+
+def frame_order(path):
+    """Sort key ordering numbered file names by number, so frame_2 comes before frame_10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", os.path.basename(path))]
+
+def read_frames(source):
+    """Yield (frame array, duration in ms) from an animated GIF/APNG or a directory of numbered frames"""
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*.png")), key=frame_order):
+            with Image.open(path) as img:
+                yield np.array(img.convert("RGBA" if "A" in img.getbands() else "RGB")), 100
+        return
+    
+    with Image.open(source) as img:
+        for index in range(getattr(img, "n_frames", 1)):
+            img.seek(index)
+            mode = "RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB"
+            yield np.array(img.convert(mode)), img.info.get("duration", 100)
+
+def sort_sequence(source, output, settings=None):
+    """Sort every frame of source into an animated GIF/APNG or a directory of numbered PNGs"""
+    sequence = SequenceSorter(settings)
+    
+    def sorted_frames():
+        for index, (frame, duration) in enumerate(read_frames(source)):
+            print(f"Frame {index}: ", end="")
+            yield Image.fromarray(sequence.sort_frame(frame)), duration
+    
+    frames = sorted_frames()
+    if output.lower().endswith(".gif"):
+        # Frames are encoded as they are sorted, so memory does not grow with the sequence
+        write_gif(output, frames)
+    elif output.lower().endswith((".png", ".apng")):
+        # PIL's APNG writer walks append_images twice, so every frame is held in memory
+        images, durations = zip(*frames)
+        images[0].save(output, save_all=True, append_images=images[1:], duration=list(durations), loop=0)
+    else:
+        os.makedirs(output, exist_ok=True)
+        for index, (frame, _) in enumerate(frames):
+            frame.save(os.path.join(output, f"frame_{index:05d}.png"))
+    print(f"Sequence saved to {output}")
+
+def sort_shard(shm_name, shape, dtype, settings, axis, start, stop):
+    """Sort columns (axis 0) or rows (axis 1) [start, stop) of a shared-memory image in place"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        # One extra line so the shard's last line is not treated as the image edge
+        sort_view(pixels[:, start:stop + 1] if axis == 0 else pixels[start:stop + 1], settings, axis)
+        del pixels
+    finally:
+        shm.close()
+
+def make_sorter(settings, **kwargs):
+    """Build a PixelSorter from a settings dict, passing kwargs through to the constructor"""
+    settings = dict(settings)
+    sorter = PixelSorter(engine=settings.pop("engine", "scan"), sort_key=settings.pop("sort_key", None), **kwargs)
+    for name, value in settings.items():
+        setattr(sorter, name, value)
+    return sorter
+
+def sort_view(pixels, settings, axis):
+    """Run one pass of a PixelSorter configured with settings over a view"""
+    sorter = make_sorter(settings, pixels=pixels)
+    if axis == 0:
+        sorter.sort_columns()
+    else:
+        sorter.sort_rows()
+
+def sort_file(path, mode, settings):
+    """Sort one image file in a batch worker and return (path, mode, seconds, megapixels)"""
+    start = time.perf_counter()
+    name, ext = os.path.splitext(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sorter = make_sorter(settings, img_filename=name, file_type=ext.lstrip("."))
+        sorter.mode = mode
+        sorter.run()
+    return path, mode, time.perf_counter() - start, sorter.width * sorter.height / 1e6
+
+def sort_batch(source, modes, engine="vectorized", sort_key=None, workers=None):
+    """Sort every image in a directory or glob once per mode on one warm process pool.
+    
+    Workers import NumPy and PIL once and then take file after file, so while one
+    worker decodes or encodes the others keep computing.
+    """
+    pattern = os.path.join(source, "*.png") if os.path.isdir(source) else source
+    paths = sorted(glob.glob(pattern))
+    # Skip the exact files this run writes, so earlier outputs are not sorted again
+    outputs = {f"{os.path.splitext(path)[0]}_{mode}.png" for path in paths for mode in modes}
+    paths = [path for path in paths if path not in outputs]
+    settings = {"engine": engine, "sort_key": sort_key}
+    print(f"Sorting {len(paths)} images in modes {list(modes)}")
+    
+    start = time.perf_counter()
+    count = 0
+    failed = 0
+    megapixels = 0.0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(sort_file, path, mode, settings): (path, mode) for path in paths for mode in modes}
+        for future in as_completed(jobs):
+            try:
+                path, mode, seconds, size = future.result()
+            except Exception as e:
+                path, mode = jobs[future]
+                print(f"Failed: {path} [mode {mode}]: {str(e)}")
+                failed += 1
+                continue
+            count += 1
+            megapixels += size
+            print(f"{path} [mode {mode}]: {seconds:.2f}s ({size:.1f} MP)")
+    
+    elapsed = time.perf_counter() - start
+    print(f"Sorted {count} images, {failed} failed, in {elapsed:.2f}s: "
+          f"{count / elapsed:.2f} images/s, {megapixels / elapsed:.2f} MP/s")
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', help='Directory or glob of images to sort')
+    parser.add_argument('--modes', default='0', help='Comma-separated sorting modes (e.g. 0,2); --sequence uses the first')
+    parser.add_argument('--sequence', help='Animated GIF/APNG or directory of numbered frames to sort')
+    parser.add_argument('--output', help='Animated file or directory for --sequence output')
+    parser.add_argument('--engine', choices=ENGINES, default='vectorized', help='Interval engine for --batch')
+    parser.add_argument('--workers', type=int, help='Worker processes for --batch (default: all cores)')
+    parser.add_argument('--cache-dir', help='Directory for cached results of repeated runs')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    sorter = PixelSorter()
-    sorter.run()
\ No newline at end of file
+    args = parse_args()
+    modes = [int(mode) for mode in args.modes.split(',')]
+    if args.sequence:
+        sort_sequence(args.sequence, args.output or "sequence_sorted", {"mode": modes[0]})
+    elif args.batch:
+        sort_batch(args.batch, modes, args.engine, workers=args.workers)
+    else:
+        sorter = PixelSorter(cache=ResultCache(args.cache_dir) if args.cache_dir else None)
+        sorter.run()
\ No newline at end of file
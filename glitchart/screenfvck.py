@@ -8,9 +8,12 @@ from Xlib import display, X
 from PIL import Image
 import numpy as np
 import ctypes
-import struct
 import argparse
 
+# Channel and alpha bits of a pixel read as a little-endian word
+COLOR_MASK = np.uint32(0x00FFFFFF)
+ALPHA_MASK = np.uint32(0xFF000000)
+
 class ScreenFuck:
     # Define glitch method names for reference
     SIMPLE_GLITCH_METHODS = [
@@ -56,6 +59,9 @@ class ScreenFuck:
             
             # Create buffer for screen data
             self.data = bytearray(self.byte_width * self.height)
+            
+            # Bulk per-pixel randomness for the glitch kernels
+            self.rng = np.random.default_rng()
             print("Initialization complete")
             
             # Initialize enabled glitch methods
@@ -114,14 +120,14 @@ class ScreenFuck:
             modes = 8 if safe_mode else 10
             mode = random.randint(0, modes - 1)
             
-            # Get raw data from X server
+            # Get raw data from X server; conversions read it in place
             raw = self.root.get_image(0, 0, self.width, self.height, X.ZPixmap, 0xffffffff)
-            raw_data = bytearray(raw.data)
+            raw_data = raw.data
             
             # Convert based on selected mode
             if mode == 0:
                 # BGRA to RGBA (default)
-                self.data = raw_data
+                self.data = bytearray(raw_data)
             elif mode == 1:
                 # BGRA to ARGB
                 self._convert_bgra_to_argb(raw_data)
@@ -155,81 +161,87 @@ class ScreenFuck:
             print(f"Screen capture failed: {str(e)}")
             sys.exit(1)
     
+    def _pixels(self, raw_data):
+        """View raw BGRA bytes as an (n, 4) uint8 array without copying"""
+        return np.frombuffer(raw_data, dtype=np.uint8).reshape(-1, 4)
+    
+    def _output(self, dtype, count):
+        """View the first count values of self.data as dtype, so conversions write straight into it"""
+        return np.frombuffer(self.data, dtype=dtype, count=count)
+    
     def _convert_bgra_to_argb(self, raw_data):
         """Convert BGRA to ARGB format"""
-        for i in range(0, len(raw_data), 4):
-            self.data[i] = raw_data[i+3]    # A
-            self.data[i+1] = raw_data[i+2]  # R
-            self.data[i+2] = raw_data[i+1]  # G
-            self.data[i+3] = raw_data[i]    # B
+        pixels = self._pixels(raw_data)
+        # Reversing each pixel's bytes: A, R, G, B
+        np.copyto(self._output(np.uint8, pixels.size).reshape(-1, 4), pixels[:, ::-1])
     
     def _convert_to_5551(self, raw_data):
         """Convert to 16-bit 5-5-5-1 format"""
-        for i in range(0, len(raw_data), 4):
-            r = raw_data[i+2] >> 3
-            g = raw_data[i+1] >> 3
-            b = raw_data[i] >> 3
-            a = 1 if raw_data[i+3] > 127 else 0
-            packed = (r << 11) | (g << 6) | (b << 1) | a
-            struct.pack_into('H', self.data, i//2, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.uint16, len(pixels))
+        np.left_shift(pixels[:, 2] >> 3, 11, out=out, dtype=np.uint16)
+        out |= (pixels[:, 1] >> 3).astype(np.uint16) << 6
+        out |= (pixels[:, 0] >> 3).astype(np.uint16) << 1
+        out |= pixels[:, 3] > 127
     
     def _convert_to_1555_rev(self, raw_data):
         """Convert to 16-bit 1-5-5-5 reversed format"""
-        for i in range(0, len(raw_data), 4):
-            a = raw_data[i+3] >> 7
-            b = raw_data[i] >> 3
-            g = raw_data[i+1] >> 3
-            r = raw_data[i+2] >> 3
-            packed = (a << 15) | (b << 10) | (g << 5) | r
-            struct.pack_into('H', self.data, i//2, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.uint16, len(pixels))
+        np.left_shift(pixels[:, 3] >> 7, 15, out=out, dtype=np.uint16)
+        out |= (pixels[:, 0] >> 3).astype(np.uint16) << 10
+        out |= (pixels[:, 1] >> 3).astype(np.uint16) << 5
+        out |= pixels[:, 2] >> 3
     
     def _convert_to_8888(self, raw_data):
         """Convert to 32-bit 8-8-8-8 format"""
-        for i in range(0, len(raw_data), 4):
-            packed = (raw_data[i+3] << 24) | (raw_data[i+2] << 16) | (raw_data[i+1] << 8) | raw_data[i]
-            struct.pack_into('I', self.data, i, packed)
+        # A << 24 | R << 16 | G << 8 | B is the pixel read as a little-endian word
+        pixels = np.frombuffer(raw_data, dtype='<u4')
+        np.copyto(self._output(np.uint32, len(pixels)), pixels)
     
     def _convert_to_8888_rev(self, raw_data):
         """Convert to 32-bit 8-8-8-8 reversed format"""
-        for i in range(0, len(raw_data), 4):
-            packed = (raw_data[i] << 24) | (raw_data[i+1] << 16) | (raw_data[i+2] << 8) | raw_data[i+3]
-            struct.pack_into('I', self.data, i, packed)
+        # B << 24 | G << 16 | R << 8 | A is the pixel read as a big-endian word
+        pixels = np.frombuffer(raw_data, dtype='>u4')
+        np.copyto(self._output(np.uint32, len(pixels)), pixels)
     
     def _convert_to_1010102(self, raw_data):
         """Convert to 32-bit 10-10-10-2 format"""
-        for i in range(0, len(raw_data), 4):
-            r = raw_data[i+2] >> 2
-            g = raw_data[i+1] >> 2
-            b = raw_data[i] >> 2
-            a = raw_data[i+3] >> 6
-            packed = (r << 22) | (g << 12) | (b << 2) | a
-            struct.pack_into('I', self.data, i, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.uint32, len(pixels))
+        np.left_shift(pixels[:, 2] >> 2, 22, out=out, dtype=np.uint32)
+        out |= (pixels[:, 1] >> 2).astype(np.uint32) << 12
+        out |= (pixels[:, 0] >> 2).astype(np.uint32) << 2
+        out |= pixels[:, 3] >> 6
     
     def _convert_to_2101010_rev(self, raw_data):
         """Convert to 32-bit 2-10-10-10 reversed format"""
-        for i in range(0, len(raw_data), 4):
-            a = raw_data[i+3] >> 6
-            r = raw_data[i+2] >> 2
-            g = raw_data[i+1] >> 2
-            b = raw_data[i] >> 2
-            packed = (a << 30) | (r << 20) | (g << 10) | b
-            struct.pack_into('I', self.data, i, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.uint32, len(pixels))
+        np.left_shift(pixels[:, 3] >> 6, 30, out=out, dtype=np.uint32)
+        out |= (pixels[:, 2] >> 2).astype(np.uint32) << 20
+        out |= (pixels[:, 1] >> 2).astype(np.uint32) << 10
+        out |= pixels[:, 0] >> 2
     
     def _convert_to_ushort(self, raw_data):
         """Convert to 16-bit unsigned short format"""
-        for i in range(0, len(raw_data), 4):
-            # Simple averaging of RGB to 16-bit
-            val = (raw_data[i+2] + raw_data[i+1] + raw_data[i]) // 3
-            packed = val << 8 | val
-            struct.pack_into('H', self.data, i//2, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.uint16, len(pixels))
+        # Simple averaging of RGB to 16-bit
+        np.add(pixels[:, 2], pixels[:, 1], out=out, dtype=np.uint16)
+        out += pixels[:, 0]
+        out //= 3
+        out |= out << 8
     
     def _convert_to_short(self, raw_data):
         """Convert to 16-bit signed short format"""
-        for i in range(0, len(raw_data), 4):
-            # Simple averaging of RGB to signed 16-bit
-            val = (raw_data[i+2] + raw_data[i+1] + raw_data[i]) // 3 - 128
-            packed = val & 0xFFFF
-            struct.pack_into('h', self.data, i//2, packed)
+        pixels = self._pixels(raw_data)
+        out = self._output(np.int16, len(pixels))
+        # Simple averaging of RGB to signed 16-bit
+        np.add(pixels[:, 2], pixels[:, 1], out=out, dtype=np.int16)
+        out += pixels[:, 0]
+        out //= 3
+        out -= 128
     
     def manipulate_buffer(self, safe_mode=False, glitches=None):
         """Apply glitch effects to the buffer"""
@@ -274,6 +286,57 @@ class ScreenFuck:
         
         print("Glitch effects complete")
     
+    def _glitch_region(self, x, y, width, height):
+        """View of the pixels a glitch covers, as an (rows, pixels, 4) array
+        
+        A glitch that fits its rows is a rectangle of a (height, byte_width/4, 4)
+        view of the buffer. A full-width glitch starting at x > 0 runs on into
+        the next row, as the byte loops did, so it is one contiguous span
+        returned as a single row.
+        """
+        buffer = np.frombuffer(self.data, dtype=np.uint8)
+        row_pixels = self.byte_width // 4
+        rows = min(y + height, self.height) - y
+        if x + width <= row_pixels:
+            screen = buffer[:self.height * self.byte_width].reshape(self.height, row_pixels, 4)
+            return screen[y:y + rows, x:x + width]
+        
+        pixels = buffer[:len(buffer) // 4 * 4].reshape(-1, 4)
+        start = y * row_pixels + x
+        end = min((y + rows - 1) * row_pixels + x + width, len(pixels))
+        return pixels[start:end][None]
+    
+    def _shift_channels(self, words):
+        """Fill each pixel's channels from the bytes 1 to 3 positions further along its row, wrapping at the end"""
+        # 8, 16 or 24 bits, equally likely
+        shift = self.rng.integers(8, 32, words.shape, dtype=np.uint64) & ~np.uint64(7)
+        # The pixel and the one after it, as one 64-bit word to slide over
+        pair = (np.roll(words, -1, axis=1).astype(np.uint64) << np.uint64(32)) | words
+        words[...] = (words & ALPHA_MASK) | ((pair >> shift).astype(np.uint32) & COLOR_MASK)
+    
+    def _sort_channels(self, region):
+        """Sort each pixel's channels by value with a three-element sorting network"""
+        low, high = np.minimum(region[..., 0], region[..., 1]), np.maximum(region[..., 0], region[..., 1])
+        top = np.maximum(low, region[..., 2])
+        region[..., 0] = np.minimum(low, region[..., 2])
+        region[..., 1] = np.minimum(high, top)
+        region[..., 2] = np.maximum(high, top)
+    
+    def _inject_noise(self, words):
+        """Replace 30% of pixels with random colors"""
+        # One draw per pixel: the low half gives the color, the high half decides
+        bits = self.rng.integers(0, 2 ** 64, words.shape + (1,), dtype=np.uint64).view('<u4')
+        hit = bits[..., 1] < int(0.3 * 2 ** 32)
+        np.copyto(words, (words & ALPHA_MASK) | (bits[..., 0] & COLOR_MASK), where=hit)
+    
+    def _zero_channels(self, words):
+        """Zero each channel of each pixel with 20% probability"""
+        # One draw per pixel, a 16-bit field per byte of the pixel
+        bits = self.rng.integers(0, 2 ** 64, words.shape + (1,), dtype=np.uint64).view('<u2')
+        hit = bits < int(0.2 * 2 ** 16)
+        hit[..., 3] = False
+        words &= ~(hit.view('<u4')[..., 0] * np.uint32(0xFF))
+    
     def _apply_glitch(self, x, y, width, height, safe_mode):
         """Apply a simple glitch effect to a region"""
         # Filter available modes based on enabled glitches
@@ -286,71 +349,33 @@ class ScreenFuck:
         # Select a random mode from available ones
         mode = random.choice(available_modes)
         
-        for row in range(y, min(y + height, self.height)):
-            offset = row * self.byte_width + x * 4
-            end = min(offset + width * 4, len(self.data))
-            
-            if mode == 0:  # swap-channels
-                # Swap color channels (only if we have enough bytes)
-                for i in range(offset, end - 2, 4):
-                    self.data[i], self.data[i+1], self.data[i+2] = \
-                        self.data[i+2], self.data[i], self.data[i+1]
-            elif mode == 1:  # invert-colors
-                # Invert colors
-                for i in range(offset, end - 2, 4):
-                    self.data[i] = 255 - self.data[i]
-                    self.data[i+1] = 255 - self.data[i+1]
-                    self.data[i+2] = 255 - self.data[i+2]
-            elif mode == 2:  # channel-shift
-                # Random channel shift
-                for i in range(offset, end - 2, 4):
-                    shift = random.randint(1, 3)
-                    self.data[i], self.data[i+1], self.data[i+2] = \
-                        self.data[(i+shift)%end], self.data[(i+1+shift)%end], self.data[(i+2+shift)%end]
-            elif mode == 3:  # channel-separation
-                # Channel separation
-                for i in range(offset, end - 2, 4):
-                    self.data[i] = min(self.data[i] + 50, 255)
-                    self.data[i+1] = max(self.data[i+1] - 50, 0)
-            elif mode == 4:  # pixel-sorting
-                # Pixel sorting
-                for i in range(offset, end - 2, 4):
-                    channels = [self.data[i], self.data[i+1], self.data[i+2]]
-                    channels.sort()
-                    self.data[i], self.data[i+1], self.data[i+2] = channels
-            elif mode == 5:  # random-noise
-                # Random noise
-                for i in range(offset, end - 2, 4):
-                    if random.random() < 0.3:
-                        self.data[i] = random.randint(0, 255)
-                        self.data[i+1] = random.randint(0, 255)
-                        self.data[i+2] = random.randint(0, 255)
-            elif mode == 6:  # channel-wrap
-                # Channel shift with wrap
-                for i in range(offset, end - 2, 4):
-                    self.data[i], self.data[i+1], self.data[i+2] = \
-                        self.data[i+1], self.data[i+2], self.data[i]
-            elif mode == 7:  # extreme-contrast
-                # Extreme contrast
-                for i in range(offset, end - 2, 4):
-                    self.data[i] = 255 if self.data[i] > 127 else 0
-                    self.data[i+1] = 255 if self.data[i+1] > 127 else 0
-                    self.data[i+2] = 255 if self.data[i+2] > 127 else 0
-            elif mode == 8:  # color-reduction
-                # 16-bit style color reduction
-                for i in range(offset, end - 2, 4):
-                    self.data[i] = self.data[i] & 0xF8
-                    self.data[i+1] = self.data[i+1] & 0xFC
-                    self.data[i+2] = self.data[i+2] & 0xF8
-            elif mode == 9:  # channel-zeroing
-                # Random channel zeroing
-                for i in range(offset, end - 2, 4):
-                    if random.random() < 0.2:
-                        self.data[i] = 0
-                    if random.random() < 0.2:
-                        self.data[i+1] = 0
-                    if random.random() < 0.2:
-                        self.data[i+2] = 0
+        region = self._glitch_region(x, y, width, height)
+        # Each pixel as one word: channel bytes 0-2 in bits 0-23, then alpha
+        words = region.view('<u4')[..., 0]
+        
+        if mode == 0:  # swap-channels
+            words[...] = (words & ALPHA_MASK) | ((words >> 16) & 0xFF) | ((words & 0xFFFF) << 8)
+        elif mode == 1:  # invert-colors
+            words ^= COLOR_MASK
+        elif mode == 2:  # channel-shift
+            self._shift_channels(words)
+        elif mode == 3:  # channel-separation
+            region[..., 0] = np.minimum(region[..., 0], 205) + 50
+            region[..., 1] = np.maximum(region[..., 1], 50) - 50
+        elif mode == 4:  # pixel-sorting
+            self._sort_channels(region)
+        elif mode == 5:  # random-noise
+            self._inject_noise(words)
+        elif mode == 6:  # channel-wrap
+            words[...] = (words & ALPHA_MASK) | ((words >> 8) & 0xFFFF) | ((words & 0xFF) << 16)
+        elif mode == 7:  # extreme-contrast
+            # A byte's top bit becomes 0xFF or 0x00 for the whole byte
+            words[...] = (words & ALPHA_MASK) | ((words & 0x808080) >> 7) * 0xFF
+        elif mode == 8:  # color-reduction
+            # 16-bit style color reduction
+            words &= 0xFFF8FCF8
+        elif mode == 9:  # channel-zeroing
+            self._zero_channels(words)
     
     def _apply_complex_glitch(self, x, y, width, height, safe_mode):
         """Apply more complex glitch effects to a region"""
@@ -364,54 +389,31 @@ class ScreenFuck:
         # Select a random mode from available ones
         mode = random.choice(available_modes)
         
-        for row in range(y, min(y + height, self.height)):
-            offset = row * self.byte_width + x * 4
-            end = min(offset + width * 4, len(self.data))
-            
-            if mode == 0:  # pixel-sort-effect
-                # Pixel sorting effect
-                for i in range(offset, end - 2, 4):
-                    # Sort RGB channels by value
-                    channels = [self.data[i], self.data[i+1], self.data[i+2]]
-                    channels.sort()
-                    self.data[i], self.data[i+1], self.data[i+2] = channels
-            elif mode == 1:  # data-bending
-                # Data bending effect
-                for i in range(offset, end - 2, 4):
-                    # Randomly shift pixel data
-                    shift = random.randint(1, 3)
-                    self.data[i], self.data[i+1], self.data[i+2] = \
-                        self.data[(i+shift)%end], self.data[(i+1+shift)%end], self.data[(i+2+shift)%end]
-            elif mode == 2:  # noise-injection
-                # Noise injection
-                for i in range(offset, end - 2, 4):
-                    if random.random() < 0.3:
-                        self.data[i] = random.randint(0, 255)
-                        self.data[i+1] = random.randint(0, 255)
-                        self.data[i+2] = random.randint(0, 255)
-            elif mode == 3:  # channel-manipulation
-                # Extreme channel manipulation
-                for i in range(offset, end - 2, 4):
-                    # Randomly zero out channels
-                    if random.random() < 0.2:
-                        self.data[i] = 0
-                    if random.random() < 0.2:
-                        self.data[i+1] = 0
-                    if random.random() < 0.2:
-                        self.data[i+2] = 0
-            elif mode == 4:  # block-transfer
-                # Block transfer effect
-                block_size = random.randint(4, 32)
-                for i in range(offset, end - block_size, block_size):
-                    src = random.randint(offset, end - block_size)
-                    self.data[i:i+block_size] = self.data[src:src+block_size]
-            elif mode == 5:  # scanline-effect
-                # Scanline effect
-                for i in range(offset, end - 2, 4):
-                    if row % 2 == 0:
-                        self.data[i] = self.data[i] // 2
-                        self.data[i+1] = self.data[i+1] // 2
-                        self.data[i+2] = self.data[i+2] // 2
+        region = self._glitch_region(x, y, width, height)
+        words = region.view('<u4')[..., 0]
+        
+        if mode == 0:  # pixel-sort-effect
+            self._sort_channels(region)
+        elif mode == 1:  # data-bending
+            self._shift_channels(words)
+        elif mode == 2:  # noise-injection
+            self._inject_noise(words)
+        elif mode == 3:  # channel-manipulation
+            self._zero_channels(words)
+        elif mode == 4:  # block-transfer
+            # Copy random byte blocks of each row over its consecutive blocks
+            block_size = random.randint(4, 32)
+            rows, count = region.shape[:2]
+            # Each row's pixels are contiguous, so this is a view of the buffer
+            row_bytes = region.reshape(rows, count * 4)
+            blocks = max(0, -(-(count * 4 - block_size) // block_size))
+            if blocks:
+                windows = np.lib.stride_tricks.sliding_window_view(row_bytes, block_size, axis=1)
+                sources = self.rng.integers(0, windows.shape[1], (rows, blocks))
+                row_bytes[:, :blocks * block_size] = windows[np.arange(rows)[:, None], sources].reshape(rows, -1)
+        elif mode == 5:  # scanline-effect
+            # Halve the colors of even screen rows
+            region[y % 2::2, :, :3] //= 2
     
     def save_image(self):
         """Save the glitched image to a file"""
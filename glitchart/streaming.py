@@ -0,0 +1,90 @@
+from PIL import Image, GifImagePlugin
+import numpy as np
+import struct
+import zlib
+
+def write_png(path, width, height, channels, bands):
+    """Write (rows, width, 3|4) uint8 bands, top to bottom, as one PNG without holding the whole image"""
+    color_type = {3: 2, 4: 6}[channels]
+    
+    def write_chunk(f, tag, data):
+        f.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data)))
+    
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        write_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        compressor = zlib.compressobj(6)
+        for band in bands:
+            rows = np.asarray(band).reshape(-1, width * channels)
+            # PNG "Sub" filter: each byte minus the same channel of the pixel to its left
+            scanlines = np.empty((rows.shape[0], width * channels + 1), dtype=np.uint8)
+            scanlines[:, 0] = 1
+            scanlines[:, 1:channels + 1] = rows[:, :channels]
+            scanlines[:, channels + 1:] = rows[:, channels:] - rows[:, :-channels]
+            data = compressor.compress(scanlines.tobytes())
+            if data:
+                write_chunk(f, b"IDAT", data)
+        write_chunk(f, b"IDAT", compressor.flush())
+        write_chunk(f, b"IEND", b"")
+
+def gif_frame(frame):
+    """Return a frame's pixels, the palette image GIF stores for it and its fully transparent palette index or None"""
+    frame = frame.convert("RGBA" if "A" in frame.getbands() else "RGB")
+    palette_frame = frame.convert("P", palette=Image.Palette.ADAPTIVE)
+    transparency = None
+    if frame.mode == "RGBA" and (np.asarray(frame)[..., 3] == 0).any():
+        # The adaptive palette keeps alpha, so look up the entry it gave the transparent pixels
+        for color, index in palette_frame.palette.colors.items():
+            if color[3] == 0:
+                transparency = index
+                break
+    return np.asarray(frame), palette_frame, transparency
+
+def changed_box(previous, pixels):
+    """Bounding box of the pixels that differ between two frames, or None if they are identical"""
+    changed = (previous != pixels).any(axis=2)
+    rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+    if not len(rows):
+        return None
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+def write_gif(path, frames, loop=0):
+    """Write (image, duration in ms) pairs as an animated GIF, encoding each frame as it arrives.
+
+    PIL's own GIF writer collects every frame before it writes any, so frames
+    are encoded here one at a time with GifImagePlugin's getheader and getdata.
+    Each frame gets its own palette and stores only the box that changed since
+    the previous one; a repeated frame extends the previous frame's duration.
+    Memory holds two frames, however long the animation.
+    """
+    previous = None
+    pending = None  # [palette image, offset, duration, transparency] awaiting its disposal
+
+    def write_frame(f, image, offset, duration, transparency, disposal):
+        params = {"duration": duration, "disposal": disposal, "include_color_table": True}
+        if transparency is not None:
+            params["transparency"] = transparency
+        for data in GifImagePlugin.getdata(image, offset, **params):
+            f.write(data)
+
+    with open(path, "wb") as f:
+        for frame, duration in frames:
+            pixels, palette_frame, transparency = gif_frame(frame)
+            if previous is None:
+                header, _ = GifImagePlugin.getheader(palette_frame.copy(), info={"loop": loop, "duration": duration})
+                f.write(b"".join(header))
+                box = (0, 0) + palette_frame.size
+            else:
+                box = changed_box(previous, pixels)
+                if box is None:
+                    pending[2] += duration
+                    continue
+                # Transparent pixels must not show the previous frame, so clear it and store the whole frame
+                if transparency is not None:
+                    box = (0, 0) + palette_frame.size
+                write_frame(f, *pending, 2 if transparency is not None else 1)
+            previous = pixels
+            pending = [palette_frame.crop(box), box[:2], duration, transparency]
+        if pending is not None:
+            write_frame(f, *pending, 0)
+        f.write(b";")